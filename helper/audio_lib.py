@@ -0,0 +1,144 @@
+import io
+import wave
+import numpy as np
+
+FRAME_MS = 30
+# Voice activity detection: a frame is silence when it is below VAD_SILENCE_DB (dBFS) and more than
+# VAD_DYNAMIC_RANGE_DB below the loud (95th percentile) frames. Only silences longer than
+# VAD_MIN_SILENCE_MS are cut, and VAD_PADDING_MS of audio is kept around speech.
+VAD_SILENCE_DB = -45
+VAD_DYNAMIC_RANGE_DB = 30
+VAD_MIN_SILENCE_MS = 1000
+VAD_PADDING_MS = 250
+SAMPLE_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+def is_wav(data):
+    return len(data) > 12 and data[0:4] == b'RIFF' and data[8:12] == b'WAVE'
+
+def read_wav(data):
+    # Return wave params and the raw PCM frames of a WAV file
+    with wave.open(io.BytesIO(data), 'rb') as w:
+        params = w.getparams()
+        frames = w.readframes(params.nframes)
+    return params, frames
+
+def write_wav(params, frames):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(params.nchannels)
+        w.setsampwidth(params.sampwidth)
+        w.setframerate(params.framerate)
+        w.writeframes(frames)
+    return buffer.getvalue()
+
+def frame_energy(params, frames, frame_ms=FRAME_MS):
+    # RMS energy of fixed size frames, mixed down to mono
+    dtype = SAMPLE_DTYPES.get(params.sampwidth)
+    if dtype is None:
+        return None, 0
+    samples = np.frombuffer(frames, dtype=dtype).astype(np.float32)
+    if params.sampwidth == 1:
+        samples -= 128
+    samples = samples.reshape(-1, params.nchannels).mean(axis=1)
+
+    frame_size = max(1, int(params.framerate * frame_ms / 1000))
+    nframes = len(samples) // frame_size
+    if nframes == 0:
+        return np.zeros(0, dtype=np.float32), frame_size
+    samples = samples[0:nframes * frame_size].reshape(nframes, frame_size)
+    return np.sqrt(np.mean(samples * samples, axis=1)), frame_size
+
+def find_split_points(energy, max_frames, min_frames):
+    # Cut at the quietest frame between min_frames and max_frames after the previous cut.
+    # Every cut advances at least one frame, so tiny segment lengths cannot loop forever.
+    min_frames = max(1, min(min_frames, max_frames))
+    cuts = []
+    start = 0
+    while len(energy) - start > max_frames:
+        window = energy[start + min_frames:start + max_frames + 1]
+        cut = start + min_frames + int(np.argmin(window))
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+def split_wav(data, max_segment_seconds, frame_ms=FRAME_MS):
+    # Split WAV audio at silence boundaries into segments no longer than max_segment_seconds.
+    # Returns a list of (offset_seconds, wav_bytes); non-WAV input, or a max_segment_seconds of 0 or less
+    # (splitting off), is returned as a single segment.
+    if not is_wav(data) or max_segment_seconds <= 0:
+        return [(0.0, data)]
+    params, frames = read_wav(data)
+    energy, frame_size = frame_energy(params, frames, frame_ms)
+    if energy is None:
+        return [(0.0, data)]
+
+    max_frames = max(1, int(max_segment_seconds * 1000 / frame_ms))
+    cuts = find_split_points(energy, max_frames, max_frames // 2)
+    if len(cuts) == 0:
+        return [(0.0, data)]
+
+    bytes_per_frame = frame_size * params.sampwidth * params.nchannels
+    bounds = [0] + cuts + [None]
+    segments = []
+    for i in range(len(bounds) - 1):
+        begin = bounds[i] * bytes_per_frame
+        end = bounds[i + 1] * bytes_per_frame if bounds[i + 1] is not None else len(frames)
+        offset = bounds[i] * frame_size / params.framerate
+        segments.append((offset, write_wav(params, frames[begin:end])))
+    return segments
+
+def voiced_runs(energy, full_scale, frame_ms=FRAME_MS):
+    # [start, end) frame ranges to keep, as two arrays
+    level = 20 * np.log10(energy / full_scale + 1e-12)
+    threshold = min(VAD_SILENCE_DB, float(np.percentile(level, 95)) - VAD_DYNAMIC_RANGE_DB)
+    voiced = level > threshold
+    if not voiced.any():
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    pad = int(VAD_PADDING_MS / frame_ms)
+    keep = np.convolve(voiced, np.ones(2 * pad + 1), mode="same") > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], keep.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+
+    # Close gaps too short to be worth cutting
+    long_gap = (starts[1:] - ends[:-1]) >= int(VAD_MIN_SILENCE_MS / frame_ms)
+    return np.concatenate((starts[0:1], starts[1:][long_gap])), np.concatenate((ends[:-1][long_gap], ends[-1:]))
+
+def trim_silence(data, frame_ms=FRAME_MS):
+    # Cut silent stretches out of WAV audio. Returns (wav_bytes, offset_map), where offset_map holds
+    # the start of every kept run on the trimmed ("trimmed") and original ("original") timelines in
+    # seconds; offset_map is None when the input is not WAV or there is nothing worth cutting.
+    if not is_wav(data):
+        return data, None
+    params, frames = read_wav(data)
+    energy, frame_size = frame_energy(params, frames, frame_ms)
+    if energy is None or len(energy) == 0:
+        return data, None
+
+    starts, ends = voiced_runs(energy, 2 ** (8 * params.sampwidth - 1), frame_ms)
+    if len(starts) == 0 or (len(starts) == 1 and starts[0] == 0 and ends[0] == len(energy)):
+        return data, None
+
+    bytes_per_frame = frame_size * params.sampwidth * params.nchannels
+    pieces = []
+    for start, end in zip(starts, ends):
+        # The partial frame at the end of the file belongs to the last run when it reaches the end
+        end_byte = len(frames) if end == len(energy) else end * bytes_per_frame
+        pieces.append(frames[start * bytes_per_frame:end_byte])
+
+    seconds_per_frame = frame_size / params.framerate
+    lengths = ends - starts
+    offset_map = {
+        "trimmed": np.round(np.concatenate(([0], np.cumsum(lengths)[:-1])) * seconds_per_frame, 3).tolist(),
+        "original": np.round(starts * seconds_per_frame, 3).tolist(),
+    }
+    return write_wav(params, b"".join(pieces)), offset_map
+
+def remap_times(times, offset_map, side="right"):
+    # Map times on the trimmed timeline back to the original audio. Use side="left" for end times,
+    # so an end that falls exactly on a cut stays with the run before it.
+    trimmed = np.asarray(offset_map["trimmed"])
+    original = np.asarray(offset_map["original"])
+    times = np.asarray(times, dtype=np.float64)
+    run = np.clip(np.searchsorted(trimmed, times, side=side) - 1, 0, len(trimmed) - 1)
+    return original[run] + (times - trimmed[run])
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from botocore.exceptions import ClientError
+
+THROTTLING_ERRORS = ('ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException', 'ProvisionedThroughputExceededException')
+
+class Overloaded(Exception):
+    pass
+
+class MicroBatcher:
+    # Gathers submitted items into batches of up to max_batch_size, waiting at most max_wait_ms
+    # after the first item, and runs process_batch(items) -> results in a worker thread.
+    # In-flight batches follow an AIMD limit: halved on downstream throttling, raised by one on success.
+    # Once max_pending items are queued, submit() raises Overloaded so callers can shed load.
+    def __init__(self, process_batch, max_batch_size=10, max_wait_ms=50, max_pending=1000, max_concurrent_batches=8):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self.max_concurrent_batches = max_concurrent_batches
+        self.concurrency_limit = max_concurrent_batches
+        self.in_flight = 0
+        self.queue = None
+        self.slot_available = None
+        self.dispatches = set()
+        self.stats = {"submitted": 0, "rejected": 0, "batches": 0, "items": 0, "throttled_batches": 0, "failed_batches": 0}
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.slot_available = asyncio.Condition()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+
+    async def submit(self, item):
+        if self.queue.qsize() >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise Overloaded(f"{self.queue.qsize()} messages pending")
+        future = asyncio.get_running_loop().create_future()
+        self.stats["submitted"] += 1
+        await self.queue.put((item, future))
+        return await future
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def has_slot(self):
+        async with self.slot_available:
+            await self.slot_available.wait_for(lambda: self.in_flight < self.concurrency_limit)
+
+    async def run(self):
+        while True:
+            # Wait for a free slot first, so items keep queueing (and get rejected) while downstream is saturated
+            await self.has_slot()
+            batch = await self.next_batch()
+            # The slot is taken once the batch is formed, so in_flight counts dispatching batches only.
+            # Throttling may have lowered the limit while the batch was gathering, so it is checked again.
+            async with self.slot_available:
+                await self.slot_available.wait_for(lambda: self.in_flight < self.concurrency_limit)
+                self.in_flight += 1
+            # Keep a reference so the event loop does not garbage-collect the task while it runs
+            task = asyncio.create_task(self.dispatch(batch))
+            self.dispatches.add(task)
+            task.add_done_callback(self.dispatches.discard)
+
+    async def dispatch(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await asyncio.to_thread(self.process_batch, items)
+            self.concurrency_limit = min(self.max_concurrent_batches, self.concurrency_limit + 1)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            if isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") in THROTTLING_ERRORS:
+                self.stats["throttled_batches"] += 1
+                self.concurrency_limit = max(1, self.concurrency_limit // 2)
+            else:
+                self.stats["failed_batches"] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+            async with self.slot_available:
+                self.in_flight -= 1
+                self.slot_available.notify_all()
+
+    def status(self):
+        return dict(
+            self.stats,
+            pending=self.queue.qsize() if self.queue else 0,
+            in_flight=self.in_flight,
+            concurrency_limit=self.concurrency_limit,
+            average_batch_size=round(self.stats["items"] / self.stats["batches"], 2) if self.stats["batches"] else 0,
+        )
@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+import functools
+import uuid
+import threading
+
+CACHE_FOLDER = os.environ.get('CACHE_FOLDER', 'data/cache/')
+CACHE_MAX_MB = int(os.environ.get('CACHE_MAX_MB', 512))
+STAGE_CACHE_ENABLED = os.environ.get('STAGE_CACHE_ENABLED', 'true').lower() == 'true'
+# Eviction trims a namespace to this share of its cap, so the next writes do not trigger it again right away
+CACHE_EVICT_TARGET = 0.9
+# The running size of a namespace is re-read from disk every this many writes, to pick up other processes
+CACHE_RESCAN_WRITES = 1000
+
+# Running size in bytes and writes since the last scan, per namespace
+namespace_sizes = {}
+namespace_sizes_lock = threading.Lock()
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def make_key(*parts):
+    return content_hash(json.dumps(parts, ensure_ascii=False, sort_keys=True))
+
+def get(namespace, key):
+    file_path = os.path.join(CACHE_FOLDER, namespace, f'{key}.json')
+    try:
+        with open(file_path, "r") as json_file:
+            value = json.load(json_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # Touch the entry so eviction drops the least recently used files first
+    try:
+        os.utime(file_path)
+    except FileNotFoundError:
+        pass
+    return value
+
+def put(namespace, key, value, max_mb=CACHE_MAX_MB):
+    folder = os.path.join(CACHE_FOLDER, namespace)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    file_path = os.path.join(folder, f'{key}.json')
+    tmp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+    data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+    with open(tmp_path, "wb") as json_file:
+        json_file.write(data)
+    try:
+        replaced = os.path.getsize(file_path)
+    except FileNotFoundError:
+        replaced = 0
+    os.replace(tmp_path, file_path)
+
+    # Keep a running total instead of scanning the folder on every write
+    with namespace_sizes_lock:
+        size = namespace_sizes.get(namespace)
+        if size is not None:
+            size["bytes"] += len(data) - replaced
+            size["writes"] += 1
+        rescan = size is None or size["bytes"] > max_mb * 1024 * 1024 or size["writes"] >= CACHE_RESCAN_WRITES
+    if rescan:
+        evict(namespace, max_mb)
+
+def evict(namespace, max_mb=CACHE_MAX_MB):
+    # Rescan the namespace and, when it is over its cap, drop the least recently used entries
+    folder = os.path.join(CACHE_FOLDER, namespace)
+    entries = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.endswith(".json"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(e[1] for e in entries)
+    max_bytes = max_mb * 1024 * 1024
+    if total > max_bytes:
+        for mtime, size, path in sorted(entries):
+            if total <= max_bytes * CACHE_EVICT_TARGET:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already evicted by a concurrent writer
+                pass
+            total -= size
+    with namespace_sizes_lock:
+        namespace_sizes[namespace] = {"bytes": total, "writes": 0}
+
+def memoize(stage, max_mb=CACHE_MAX_MB, cacheable=None):
+    # Memoize a pipeline stage on disk by its JSON-serializable inputs. None results, and results
+    # cacheable(value) rejects, are returned but not stored, so a rerun tries them again.
+    def decorator(func):
+        namespace = f'stage/{stage}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not STAGE_CACHE_ENABLED:
+                return func(*args, **kwargs)
+            key = make_key(func.__name__, args, kwargs)
+            cached = get(namespace, key)
+            if cached is not None:
+                return cached["value"]
+            value = func(*args, **kwargs)
+            if value is not None and (cacheable is None or cacheable(value)):
+                put(namespace, key, {"value": value}, max_mb)
+            return value
+
+        return wrapper
+    return decorator
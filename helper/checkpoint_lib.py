@@ -0,0 +1,55 @@
+import os
+import json
+
+from helper import cache_lib
+from helper import result_lib
+
+CHECKPOINT_FOLDER = os.environ.get('CHECKPOINT_FOLDER', 'data/checkpoints/')
+
+def checkpoint_path(file_name, *run_settings):
+    # One log per input file and run settings, so a changed prompt starts a new log
+    run_key = cache_lib.make_key(file_name, *run_settings)[0:12]
+    return f"{CHECKPOINT_FOLDER}{file_name.split('/')[-1]}.{run_key}.jsonl"
+
+def row_hash(text):
+    return cache_lib.content_hash(text)[0:16]
+
+def load_checkpoint(path):
+    # Map of row index to input hash for rows already evaluated
+    done = {}
+    if not os.path.exists(path):
+        return done
+    for entry in iter_checkpoint(path):
+        done[entry["row"]] = entry["hash"]
+    return done
+
+def iter_checkpoint(path):
+    with open(path, "r") as log_file:
+        for line in log_file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave the last line partially written
+                continue
+
+def open_checkpoint(path, resume=True):
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    return open(path, "a" if resume else "w")
+
+def append_checkpoint(log_file, row, text_hash, item):
+    entry = dict(result_lib.encode_text_entry(item), row=row, hash=text_hash)
+    log_file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+    log_file.flush()
+    os.fsync(log_file.fileno())
+
+def load_evaluations(path, rows=None):
+    # Latest result of every row, in row order. rows maps the row index to the input hash of the rows in
+    # the current file, so rows logged for an older or longer file with the same name are left out.
+    items = {}
+    for entry in iter_checkpoint(path):
+        if rows is not None and rows.get(entry["row"]) != entry["hash"]:
+            continue
+        items[entry["row"]] = entry
+    return [result_lib.decode_text_entry(items[row]) for row in sorted(items)]
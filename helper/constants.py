@@ -24,4 +24,23 @@ Does the chat message violate the policy?
 Please consider and provide your analysis in the `<analysis>` tag, breaking down each rule in the rule section, and keep and analysis within 100 words. 
 Respond in the `<answer>` tag with either 'Y' or 'N'. 'Y' indicates that the message violates the policy, while 'N' means the content is safe and does not violate the policy.
 
-Assistant:"""
\ No newline at end of file
+Assistant:"""
+
+TEXT_BATCH_EVAL_PROMPTS_TEMPLATE = """Human: You are a Trust & Safety expert. 
+Your job is to review user chat messages and decide if each of them violates the policy. 
+You will find the chat messages in the <message> tags, each with an id attribute, and find the policy in the <policy> tag.
+
+<policy>{policy}</policy>
+{messages}
+
+Does each chat message violate the policy? Evaluate every message on its own.
+For each message, provide your analysis in an `<analysis id="...">` tag with the message id, keeping each analysis within 50 words. 
+Then respond in an `<answer id="...">` tag with the message id with either 'Y' or 'N'. 'Y' indicates that the message violates the policy, while 'N' means the content is safe and does not violate the policy.
+
+Assistant:"""
+
+# Appended to an evaluation prompt for the fast model of the cascade, whose confidence decides escalation
+CONFIDENCE_PROMPT_SUFFIX = """
+Finally, respond in the `<confidence>` tag with a number between 0 and 1 for how confident you are in your answer.
+
+Assistant:"""
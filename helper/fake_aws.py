@@ -0,0 +1,272 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from botocore.exceptions import ClientError
+
+from helper import cache_lib
+from helper import region_lib
+
+# Latency, throttling and failure settings per boto3 service name; "default" applies to all services
+DEFAULT_CONFIG = {
+    "default": {"latency_ms": {"dist": "lognormal", "median": 50, "sigma": 0.5}, "throttle_rate": 0.0, "failure_rate": 0.0, "max_attempts": 5},
+    "comprehend": {"latency_ms": {"dist": "lognormal", "median": 80, "sigma": 0.4}},
+    "translate": {"latency_ms": {"dist": "lognormal", "median": 120, "sigma": 0.4}},
+    "bedrock-agent-runtime": {"latency_ms": {"dist": "lognormal", "median": 250, "sigma": 0.5}},
+    # model_latency_ms overrides latency_ms for model ids containing the key
+    "bedrock-runtime": {"latency_ms": {"dist": "lognormal", "median": 1500, "sigma": 0.6}, "model_latency_ms": {"haiku": {"dist": "lognormal", "median": 400, "sigma": 0.5}}},
+    "transcribe": {"latency_ms": {"dist": "fixed", "median": 20}, "job_seconds": 2.0},
+}
+# Services helper/lib.py spreads across regions
+POOLED_SERVICES = ("translate", "comprehend", "bedrock-runtime")
+TOXIC_WORDS = {"hate", "kill", "stupid", "idiot", "damn", "die", "ugly", "loser"}
+
+def service_config(config, service):
+    merged = dict(DEFAULT_CONFIG["default"])
+    merged.update(DEFAULT_CONFIG.get(service, {}))
+    merged.update((config or {}).get("default", {}))
+    merged.update((config or {}).get(service, {}))
+    return merged
+
+def sample_latency(latency, rng):
+    dist = latency.get("dist", "fixed")
+    median = latency.get("median", 0) / 1000
+    if dist == "lognormal":
+        return rng.lognormvariate(math.log(max(median, 1e-6)), latency.get("sigma", 0.5))
+    if dist == "uniform":
+        return rng.uniform(latency.get("min", 0) / 1000, latency.get("max", 0) / 1000)
+    return median
+
+def toxicity_score(text):
+    # Deterministic fake score: share of toxic words plus a little hash noise
+    words = [w.strip(".,!?").lower() for w in text.split()]
+    hits = sum(1 for w in words if w in TOXIC_WORDS)
+    noise = int(cache_lib.content_hash(text)[0:4], 16) / 0xFFFF * 0.2
+    return round(min(1.0, hits * 0.5 + noise), 4)
+
+class FakeBody:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+class FakeClient:
+    service = None
+
+    def __init__(self, config=None, seed=None, region=None):
+        self.config = service_config(config, self.service)
+        self.region = region
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.failed = 0
+
+    def _call(self, operation, latency_ms=None):
+        # Simulated round trip with throttling and failures, retried like botocore's default retry mode
+        max_attempts = self.config.get("max_attempts", 1)
+        for attempt in range(max_attempts):
+            with self.lock:
+                self.calls += 1
+                latency = sample_latency(latency_ms or self.config["latency_ms"], self.rng)
+                roll = self.rng.random()
+            time.sleep(latency)
+            if roll < self.config["throttle_rate"]:
+                code = "ThrottlingException"
+                with self.lock:
+                    self.throttled += 1
+            elif roll < self.config["throttle_rate"] + self.config["failure_rate"]:
+                code = "InternalServerException"
+                with self.lock:
+                    self.failed += 1
+            else:
+                return
+            if attempt + 1 < max_attempts:
+                time.sleep(self.rng.uniform(0, min(20, 0.05 * 2 ** attempt)))
+        raise ClientError({"Error": {"Code": code, "Message": f"Injected by fake {self.service}"}}, operation)
+
+class FakeS3(FakeClient):
+    service = "s3"
+
+    def __init__(self, config=None, seed=None, region=None):
+        super().__init__(config, seed, region)
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        self._call("PutObject")
+        self.objects[(bucket, key)] = fileobj.read()
+
+    def put_object(self, Bucket, Key, Body):
+        self._call("PutObject")
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.encode("utf-8")
+
+    def get_object(self, Bucket, Key):
+        self._call("GetObject")
+        return {"Body": FakeBody(self.objects[(Bucket, Key)])}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return f'https://{Params["Bucket"]}.s3.local/{Params["Key"]}?expires={ExpiresIn}'
+
+class FakeTranscribe(FakeClient):
+    service = "transcribe"
+
+    def __init__(self, config=None, seed=None, region=None, s3=None):
+        super().__init__(config, seed, region)
+        self.s3 = s3
+        self.jobs = {}
+
+    def start_transcription_job(self, TranscriptionJobName, Media, OutputBucketName, OutputKey, **kwargs):
+        self._call("StartTranscriptionJob")
+        text = "this is a fake transcription of the uploaded audio you stupid loser. have a nice day."
+        results = {"transcripts": [{"transcript": text}], "items": []}
+        if kwargs.get("IdentifyLanguage"):
+            results["language_code"] = "en-US"
+        if kwargs.get("ToxicityDetection"):
+            results["toxicity_detection"] = [
+                {"text": s.strip() + ".", "toxicity": toxicity_score(s), "categories": {"profanity": toxicity_score(s)}, "start_time": i * 2.0, "end_time": i * 2.0 + 2.0}
+                for i, s in enumerate(text.split(".")) if s.strip()
+            ]
+        self.s3.objects[(OutputBucketName, f"{OutputKey}{TranscriptionJobName}.json")] = json.dumps({"jobName": TranscriptionJobName, "results": results}).encode("utf-8")
+        self.jobs[TranscriptionJobName] = time.time() + self.config.get("job_seconds", 0)
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self._call("GetTranscriptionJob")
+        status = "COMPLETED" if time.time() >= self.jobs[TranscriptionJobName] else "IN_PROGRESS"
+        return {"TranscriptionJob": {"TranscriptionJobName": TranscriptionJobName, "TranscriptionJobStatus": status}}
+
+class FakeTranslate(FakeClient):
+    service = "translate"
+
+    def translate_text(self, Text, SourceLanguageCode, TargetLanguageCode, **kwargs):
+        self._call("TranslateText")
+        return {"TranslatedText": Text, "SourceLanguageCode": SourceLanguageCode, "TargetLanguageCode": TargetLanguageCode}
+
+class FakeComprehend(FakeClient):
+    service = "comprehend"
+
+    def detect_toxic_content(self, TextSegments, LanguageCode):
+        self._call("DetectToxicContent")
+        result = []
+        for segment in TextSegments:
+            score = toxicity_score(segment["Text"])
+            result.append({"Toxicity": score, "Labels": [{"Name": "PROFANITY", "Score": score}, {"Name": "INSULT", "Score": round(score * 0.8, 4)}]})
+        return {"ResultList": result}
+
+    def detect_dominant_language(self, Text):
+        self._call("DetectDominantLanguage")
+        return {"Languages": [{"LanguageCode": "en", "Score": 0.99}]}
+
+    def batch_detect_dominant_language(self, TextList):
+        self._call("BatchDetectDominantLanguage")
+        return {"ResultList": [{"Index": i, "Languages": [{"LanguageCode": "en", "Score": 0.99}]} for i in range(len(TextList))], "ErrorList": []}
+
+class FakeBedrockAgentRuntime(FakeClient):
+    service = "bedrock-agent-runtime"
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration=None, **kwargs):
+        self._call("Retrieve")
+        search = (retrievalConfiguration or {}).get("vectorSearchConfiguration", {})
+        n = search.get("numberOfResults", 3)
+        # An "in" filter on the category key returns rules of those categories only
+        categories = search.get("filter", {}).get("in", {}).get("value")
+        if categories:
+            return {"retrievalResults": [
+                {"content": {"text": f"Policy rule {i + 1} on {categories[i % len(categories)].lower()}: not allowed."}, "location": {"s3Location": {"uri": f"s3://fake-policies/{categories[i % len(categories)].lower()}-{i + 1}.txt"}}, "metadata": {"category": categories[i % len(categories)]}, "score": 0.5}
+                for i in range(n)
+            ]}
+        return {"retrievalResults": [
+            {"content": {"text": f"Policy rule {i + 1}: insults, hate speech and threats are not allowed."}, "location": {"s3Location": {"uri": f"s3://fake-policies/rule-{i + 1}.txt"}}, "score": 0.5}
+            for i in range(n)
+        ]}
+
+class FakeBedrockRuntime(FakeClient):
+    service = "bedrock-runtime"
+
+    def invoke_model(self, body, modelId, contentType=None, accept=None, **kwargs):
+        model_latency = [v for k, v in self.config.get("model_latency_ms", {}).items() if k in modelId]
+        self._call("InvokeModel", model_latency[0] if model_latency else None)
+        request = json.loads(body)
+        messages = request.get("messages")
+        if messages is not None:
+            prompt = "".join(c["text"] for m in messages for c in m["content"] if c.get("type") == "text")
+        else:
+            prompt = request["prompt"]
+        packed = re.findall(r'<message id="(\w+)">(.*?)</message>', prompt, re.DOTALL)
+        if len(packed) > 0:
+            completion = "".join(
+                f'<analysis id="{i}">Fake analysis by {modelId}.</analysis><answer id="{i}">{"Y" if toxicity_score(m) >= 0.5 else "N"}</answer>'
+                for i, m in packed
+            )
+        else:
+            message = prompt.split("<message>")[-1].split("</message>")[0]
+            score = toxicity_score(message)
+            answer = "Y" if score >= 0.5 else "N"
+            completion = f"<analysis>Fake analysis by {modelId}.</analysis><answer>{answer}</answer>"
+            if "<confidence>" in prompt:
+                # Less sure the closer the score is to the decision boundary
+                completion += f"<confidence>{round(0.5 + abs(score - 0.5), 2)}</confidence>"
+        if messages is not None:
+            return {"body": FakeBody(json.dumps({"content": [{"type": "text", "text": completion}]}).encode("utf-8"))}
+        return {"body": FakeBody(json.dumps({"completion": completion}).encode("utf-8"))}
+
+class FakeRekognition(FakeClient):
+    service = "rekognition"
+
+    def start_celebrity_recognition(self, Video, **kwargs):
+        self._call("StartCelebrityRecognition")
+        return {"JobId": str(uuid.uuid4())}
+
+    def get_celebrity_recognition(self, JobId, **kwargs):
+        self._call("GetCelebrityRecognition")
+        return {"JobStatus": "SUCCEEDED", "Celebrities": []}
+
+def make_fake_clients(config=None, seed=None, region=None):
+    s3 = FakeS3(config, seed, region)
+    return {
+        "s3": s3,
+        "transcribe": FakeTranscribe(config, seed, region, s3=s3),
+        "translate": FakeTranslate(config, seed, region),
+        "comprehend": FakeComprehend(config, seed, region),
+        "bedrock-agent-runtime": FakeBedrockAgentRuntime(config, seed, region),
+        "bedrock-runtime": FakeBedrockRuntime(config, seed, region),
+        "rekognition": FakeRekognition(config, seed, region),
+    }
+
+def region_config(config, region):
+    # Per-region overrides under config["regions"][region], e.g. {"us-west-2": {"comprehend": {"throttle_rate": 0.5}}}
+    merged = {k: v for k, v in (config or {}).items() if k != "regions"}
+    for service, overrides in (((config or {}).get("regions") or {}).get(region) or {}).items():
+        merged[service] = dict(merged.get(service, {}), **overrides)
+    return merged
+
+def install(lib, config=None, seed=None, regions=None):
+    # Swap every AWS client in helper/lib.py for a local fake and return the fakes.
+    # With several regions (the regions argument or the keys of config["regions"]), the pooled services
+    # get one fake per region behind a region_lib.RegionPool, and their fakes are returned as "<service>@<region>".
+    regions = list(regions or (config or {}).get("regions") or [None])
+    fakes = make_fake_clients(region_config(config, regions[0]), seed, regions[0])
+    clients = dict(fakes)
+    if len(regions) > 1:
+        for service in POOLED_SERVICES:
+            regional = {}
+            for idx, region in enumerate(regions):
+                regional[region] = make_fake_clients(region_config(config, region), None if seed is None else seed + idx, region)[service]
+                fakes[f"{service}@{region}"] = regional[region]
+            del fakes[service]
+            clients[service] = region_lib.RegionPool(service, regional, seed=seed)
+    lib.s3 = clients["s3"]
+    lib.transcribe = clients["transcribe"]
+    lib.translate = clients["translate"]
+    lib.comprehend = clients["comprehend"]
+    lib.bedrock_agent_runtime_client = clients["bedrock-agent-runtime"]
+    lib.bedrock_runtime = clients["bedrock-runtime"]
+    lib.rekognition = clients["rekognition"]
+    lib.AWS_BUCKET_NAME = lib.AWS_BUCKET_NAME or "fake-bucket"
+    lib.TRANSCRIBE_POLL_SECONDS = 0.2
+    # Memoized results would hide the simulated latency
+    cache_lib.STAGE_CACHE_ENABLED = False
+    return fakes
@@ -1,16 +1,34 @@
 import os
 import boto3
+from botocore.exceptions import NoCredentialsError, ClientError
 import json
+import csv
+import io
 from io import BytesIO
 import re
 import uuid
 import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from helper import audio_lib
+from helper import cache_lib
+from helper import retrieval_lib
+from helper import region_lib
+from helper.result_lib import Reference, LlmResult, TextItem, Toxicity
+from helper import constants
 
 AWS_REGION = os.environ.get('AWS_REGION','us-east-1')
 AWS_BUCKET_NAME = os.environ.get('AWS_BUCKET_NAME')
 AWS_S3_PREFIX = os.environ.get('AWS_S3_PREFIX', 'policy-eval-demo')
 TRANSCRIBE_OUTPUT_PREFIX = 'policy-eval-demo/transcription/'
 TRANSCRIBE_JOB_PREFIX = 'ch-audio-analysis'
+TRANSCRIBE_SEGMENT_SECONDS = int(os.environ.get('TRANSCRIBE_SEGMENT_SECONDS', 300))
+TRANSCRIBE_MAX_PARALLEL_JOBS = int(os.environ.get('TRANSCRIBE_MAX_PARALLEL_JOBS', 8))
+TRANSCRIBE_POLL_SECONDS = 5
+TRANSCRIPTION_CACHE = 'transcription'
+TRANSCRIPTION_CACHE_MAX_MB = int(os.environ.get('TRANSCRIPTION_CACHE_MAX_MB', 256))
 SUPPORTED_LANGUAGE = [
         'af', 'sq', 'am', 'ar', 'hy', 'az', 'bn', 'bs', 'bg', 'ca', 'zh', 'zh-TW', 'hr', 'cs', 'da', 'fa-AF',
         'nl', 'en', 'et', 'fa', 'tl', 'fi', 'fr', 'fr-CA', 'ka', 'de', 'el', 'gu', 'ht', 'ha', 'he', 'hi', 'hu',
@@ -19,15 +37,45 @@ SUPPORTED_LANGUAGE = [
         'th', 'tr', 'uk', 'ur', 'uz', 'vi', 'cy'
     ]
 BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', "anthropic.claude-v2")
+# Model cascade: chunks go to the fast model first and escalate to BEDROCK_MODEL_ID when its verdict
+# is missing or less confident than LLM_ESCALATION_CONFIDENCE. Off unless BEDROCK_FAST_MODEL_ID is set,
+# e.g. to anthropic.claude-3-haiku-20240307-v1:0.
+BEDROCK_FAST_MODEL_ID = os.environ.get('BEDROCK_FAST_MODEL_ID', "")
+LLM_ESCALATION_CONFIDENCE = float(os.environ.get('LLM_ESCALATION_CONFIDENCE', 0.8))
+LLM_LATENCY_SAMPLES = 1000
+LLM_MAX_TOKENS = 300
+# Output budget per message of a packed batch prompt: a 50-word analysis plus the answer and id tags
+LLM_BATCH_TOKENS_PER_MESSAGE = 120
 BEDROCK_KNOWLEDGE_BASE_ID = os.environ.get('BEDROCK_KNOWLEDGE_BASE_ID')
+# Policy retrieval backend: 'bedrock' (Knowledge Base) or 'local' (in-process BM25 index over POLICY_DOCS_FOLDER)
+POLICY_RETRIEVAL_BACKEND = os.environ.get('POLICY_RETRIEVAL_BACKEND', 'bedrock')
+# Restrict retrieval to policy documents whose "category" metadata matches the toxicity categories
+# scoring at least POLICY_CATEGORY_MIN_SCORE; GENERAL documents are always eligible
+POLICY_CATEGORY_FILTER = os.environ.get('POLICY_CATEGORY_FILTER', 'false').lower() == 'true'
+POLICY_CATEGORY_MIN_SCORE = float(os.environ.get('POLICY_CATEGORY_MIN_SCORE', 0.5))
+POLICY_CATEGORY_KEY = 'category'
+POLICY_GENERAL_CATEGORY = 'GENERAL'
+LLM_MAX_CALLS_PER_FILE = int(os.environ.get('LLM_MAX_CALLS_PER_FILE', 0))
+# Adjacent low-risk chunks are evaluated together in windows of up to this many (estimated) tokens; 0 disables merging
+LLM_CHUNK_TOKEN_BUDGET = int(os.environ.get('LLM_CHUNK_TOKEN_BUDGET', 1000))
+CHARS_PER_TOKEN = 4
+COMPREHEND_TOXICITY_BATCH_SIZE = 10
+COMPREHEND_LANGUAGE_BATCH_SIZE = 25
+# Comprehend language detection accepts up to 5,000 bytes per document; the start of a text is enough
+COMPREHEND_LANGUAGE_MAX_BYTES = 4500
+RETRIEVAL_QUERY_CHAR_LIMIT = 1000
+# Amazon Translate accepts up to 10,000 bytes per TranslateText request
+TRANSLATE_MAX_BYTES = 9000
+TRANSLATE_MAX_PARALLEL_REQUESTS = int(os.environ.get('TRANSLATE_MAX_PARALLEL_REQUESTS', 8))
 
 s3 = boto3.client('s3')
 bedrock_agent_runtime_client = boto3.client("bedrock-agent-runtime")
 transcribe = boto3.client('transcribe')
-translate = boto3.client('translate')
-comprehend = boto3.client('comprehend')
 rekognition = boto3.client('rekognition')
-bedrock_runtime = boto3.client('bedrock-runtime')
+# Stateless calls are spread across AWS_REGIONS; S3, Transcribe, Rekognition and the Knowledge Base stay in one region
+translate = region_lib.make_pool('translate')
+comprehend = region_lib.make_pool('comprehend')
+bedrock_runtime = region_lib.make_pool('bedrock-runtime')
 
 def upload_to_s3(uploaded_audio):
     # upload file
@@ -37,8 +85,6 @@ def upload_to_s3(uploaded_audio):
     return AWS_BUCKET_NAME, s3_key
 
 def generate_presigned_url(bucket_name, object_key, expiration_time=3600):
-    s3 = boto3.client('s3')
-
     try:
         url = s3.generate_presigned_url(
             'get_object',
@@ -83,8 +129,31 @@ def chunk_text(text, sentence_limit=3, char_limit=400):
 
     return chunks
 
-def transcribe_audio(s3_bucket, s3_key, detect_language=False, enable_toxicity=True):
-    job_name = f'{TRANSCRIBE_JOB_PREFIX}-{str(uuid.uuid4())[0:5]}'
+def estimate_tokens(text):
+    # Rough count for English text, close enough for sizing windows
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def plan_llm_windows(texts, high_risk, token_budget=LLM_CHUNK_TOKEN_BUDGET):
+    # Group chunk indexes into LLM windows: high-risk chunks stay on their own for precise attribution,
+    # runs of adjacent low-risk chunks are merged up to token_budget
+    windows, current, tokens = [], [], 0
+    for idx, (text, high) in enumerate(zip(texts, high_risk)):
+        size = estimate_tokens(text)
+        if current and (high or tokens + size > token_budget):
+            windows.append(current)
+            current, tokens = [], 0
+        if high:
+            windows.append([idx])
+            continue
+        current.append(idx)
+        tokens += size
+    if current:
+        windows.append(current)
+    return windows
+
+def start_transcription_job(s3_bucket, s3_key, detect_language=False, enable_toxicity=True, job_name=None):
+    if job_name is None:
+        job_name = f'{TRANSCRIBE_JOB_PREFIX}-{str(uuid.uuid4())[0:5]}'
     if detect_language:
         transcribe.start_transcription_job(
                         TranscriptionJobName = job_name,
@@ -110,13 +179,15 @@ def transcribe_audio(s3_bucket, s3_key, detect_language=False, enable_toxicity=T
                         OutputKey = TRANSCRIBE_OUTPUT_PREFIX,
                         LanguageCode = 'en-US'
                     )
+    return job_name
 
+def wait_transcription_job(s3_bucket, job_name):
     # Wait until job completes
     job = transcribe.get_transcription_job(TranscriptionJobName = job_name)
 
     print("Transcribing audio. Job name: {0}".format(job_name))
     while(job['TranscriptionJob']['TranscriptionJobStatus'] not in ['COMPLETED', 'FAILED']):
-        time.sleep(5)
+        time.sleep(TRANSCRIBE_POLL_SECONDS)
         print('.', end='')
 
         job = transcribe.get_transcription_job(TranscriptionJobName = job_name)
@@ -125,9 +196,9 @@ def transcribe_audio(s3_bucket, s3_key, detect_language=False, enable_toxicity=T
     # Read transcription file
     s3_clientobj = s3.get_object(Bucket=s3_bucket, Key=f'{TRANSCRIBE_OUTPUT_PREFIX}{job_name}.json')
     s3_clientdata = s3_clientobj["Body"].read().decode("utf-8")
-    original = json.loads(s3_clientdata)
-    #print(original)
-    
+    return json.loads(s3_clientdata)
+
+def parse_transcriptions(original):
     transcriptions = []
     if "toxicity_detection" in original["results"]:
         for item in original["results"]["toxicity_detection"]:
@@ -139,15 +210,199 @@ def transcribe_audio(s3_bucket, s3_key, detect_language=False, enable_toxicity=T
         ts = chunk_text(transcription)
         for t in ts:
             transcriptions.append({"text": t})
-            
-    return original, transcriptions
+
+    return transcriptions
+
+def transcribe_audio(s3_bucket, s3_key, detect_language=False, enable_toxicity=True):
+    job_name = start_transcription_job(s3_bucket, s3_key, detect_language, enable_toxicity)
+    original = wait_transcription_job(s3_bucket, job_name)
+    #print(original)
+
+    return original, parse_transcriptions(original)
+
+def shift_transcription(original, offset):
+    # Move segment and word timestamps of a partial transcription onto the full audio timeline
+    results = original["results"]
+    for item in results.get("toxicity_detection", []):
+        for key in ("start_time", "end_time"):
+            if key in item:
+                item[key] = round(float(item[key]) + offset, 3)
+    for item in results.get("items", []):
+        for key in ("start_time", "end_time"):
+            if key in item:
+                item[key] = f'{float(item[key]) + offset:.3f}'
+    return original
+
+def merge_transcriptions(job_name, originals):
+    # Stitch partial transcriptions (already shifted, in audio order) into one transcription result
+    results = {"transcripts": [], "items": []}
+    transcripts = []
+    languages = []
+    for original in originals:
+        r = original["results"]
+        transcripts.append("".join(t.get("transcript", "") for t in r["transcripts"]).strip())
+        results["items"] += r.get("items", [])
+        if "toxicity_detection" in r:
+            results.setdefault("toxicity_detection", [])
+            results["toxicity_detection"] += r["toxicity_detection"]
+        if "language_code" in r:
+            languages.append(r["language_code"])
+
+    results["transcripts"].append({"transcript": " ".join(t for t in transcripts if len(t) > 0)})
+    if len(languages) > 0:
+        results["language_code"] = max(set(languages), key=languages.count)
+
+    return {"jobName": job_name, "results": results}
+
+def transcribe_audio_split(s3_bucket, s3_key, audio_bytes, detect_language=False, enable_toxicity=True, max_segment_seconds=TRANSCRIBE_SEGMENT_SECONDS):
+    # Split long WAV audio at silence and transcribe the segments as concurrent jobs
+    segments = audio_lib.split_wav(audio_bytes, max_segment_seconds)
+    if len(segments) <= 1:
+        return transcribe_audio(s3_bucket, s3_key, detect_language, enable_toxicity)
+
+    job_prefix = f'{TRANSCRIBE_JOB_PREFIX}-{str(uuid.uuid4())[0:5]}'
+    print(f"Transcribing {len(segments)} audio segments in parallel. Job prefix: {job_prefix}")
+
+    def run_segment(idx, offset, data):
+        segment_key = f'{s3_key}.part{idx}.wav'
+        s3.upload_fileobj(BytesIO(data), s3_bucket, segment_key)
+        job_name = start_transcription_job(s3_bucket, segment_key, detect_language, enable_toxicity, job_name=f'{job_prefix}-{idx}')
+        return shift_transcription(wait_transcription_job(s3_bucket, job_name), offset)
+
+    with ThreadPoolExecutor(max_workers=TRANSCRIBE_MAX_PARALLEL_JOBS) as executor:
+        futures = [executor.submit(run_segment, idx, offset, data) for idx, (offset, data) in enumerate(segments)]
+        originals = [f.result() for f in futures]
+
+    original = merge_transcriptions(job_prefix, originals)
+    return original, parse_transcriptions(original)
+
+def remap_transcription(original, offset_map):
+    # Move segment and word timestamps of a silence-trimmed transcription back onto the original audio timeline
+    results = original["results"]
+    for rows, as_text in ((results.get("toxicity_detection", []), False), (results.get("items", []), True)):
+        rows = [r for r in rows if "start_time" in r and "end_time" in r]
+        if len(rows) == 0:
+            continue
+        for key, side in (("start_time", "right"), ("end_time", "left")):
+            times = audio_lib.remap_times([float(r[key]) for r in rows], offset_map, side)
+            for r, t in zip(rows, times):
+                r[key] = f'{t:.3f}' if as_text else round(float(t), 3)
+    return original
+
+def transcribe_audio_trimmed(s3_bucket, s3_key, audio_bytes, detect_language=False, enable_toxicity=True, split_audio=False):
+    # Transcribe WAV audio with its silent stretches cut out, optionally split into concurrent jobs
+    trimmed, offset_map = audio_lib.trim_silence(audio_bytes)
+    if offset_map is None:
+        if split_audio:
+            return transcribe_audio_split(s3_bucket, s3_key, audio_bytes, detect_language, enable_toxicity)
+        return transcribe_audio(s3_bucket, s3_key, detect_language, enable_toxicity)
+
+    print(f"Trimmed silence: {len(audio_bytes)} to {len(trimmed)} bytes, {len(offset_map['original'])} voiced runs")
+    # The original upload stays in place for playback; Transcribe gets the condensed copy
+    trimmed_key = f'{s3_key}.trimmed.wav'
+    s3.upload_fileobj(BytesIO(trimmed), s3_bucket, trimmed_key)
+    if split_audio:
+        original, _ = transcribe_audio_split(s3_bucket, trimmed_key, trimmed, detect_language, enable_toxicity)
+    else:
+        original, _ = transcribe_audio(s3_bucket, trimmed_key, detect_language, enable_toxicity)
+    original = remap_transcription(original, offset_map)
+    return original, parse_transcriptions(original)
+
+def transcription_cache_key(audio_hash, detect_language=False, enable_toxicity=True, trim_silence=False):
+    # Untrimmed keys are unchanged, so transcriptions cached before trimming existed stay valid
+    if trim_silence:
+        return cache_lib.make_key(audio_hash, detect_language, enable_toxicity, "trim_silence")
+    return cache_lib.make_key(audio_hash, detect_language, enable_toxicity)
+
+def get_cached_transcription(audio_hash, detect_language=False, enable_toxicity=True, trim_silence=False):
+    # Returns {"original", "s3_bucket", "s3_key"} of a prior transcription of the same audio content
+    return cache_lib.get(TRANSCRIPTION_CACHE, transcription_cache_key(audio_hash, detect_language, enable_toxicity, trim_silence))
+
+def put_cached_transcription(audio_hash, original, s3_bucket, s3_key, detect_language=False, enable_toxicity=True, trim_silence=False):
+    cache_lib.put(
+        TRANSCRIPTION_CACHE,
+        transcription_cache_key(audio_hash, detect_language, enable_toxicity, trim_silence),
+        {"original": original, "s3_bucket": s3_bucket, "s3_key": s3_key},
+        TRANSCRIPTION_CACHE_MAX_MB
+    )
+
+def read_csv_header(file_obj, encoding="utf-8"):
+    # First row of a CSV upload, used to pick the message column
+    file_obj.seek(0)
+    stream = io.TextIOWrapper(file_obj, encoding=encoding, newline="")
+    try:
+        return next(csv.reader(stream), [])
+    finally:
+        stream.detach()
+        file_obj.seek(0)
+
+def iter_text_rows(file_obj, file_type="txt", column=0, skip_header=False, encoding="utf-8"):
+    # Stream (row number, message) pairs from a TXT or CSV upload without reading the whole file.
+    # CSV rows are parsed with the csv module, so quoted cells may span multiple lines.
+    file_obj.seek(0)
+    stream = io.TextIOWrapper(file_obj, encoding=encoding, newline="")
+    try:
+        if file_type == "csv":
+            for idx, row in enumerate(csv.reader(stream), 1):
+                if skip_header and idx == 1:
+                    continue
+                yield idx, row[column] if column < len(row) else ""
+        else:
+            for idx, line in enumerate(stream, 1):
+                yield idx, line.rstrip("\r\n")
+    finally:
+        # Leave the underlying upload open for reruns
+        stream.detach()
+
+def split_text_by_bytes(text, max_bytes=TRANSLATE_MAX_BYTES):
+    # Split text at sentence boundaries into pieces of at most max_bytes UTF-8 bytes.
+    # Sentences longer than the limit are cut at the last whitespace that fits.
+    pieces, current = [], ""
+    # Latin sentence ends need following whitespace, so "3.14" or "example.com" is not cut; CJK ones do not
+    for sentence in re.split(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?:(?<=\.|\?|!)\s+|(?<=。|？|！)\s*)', text):
+        while len(sentence.encode("utf-8")) > max_bytes:
+            cut = sentence.encode("utf-8")[0:max_bytes].decode("utf-8", errors="ignore")
+            if " " in cut.strip():
+                cut = cut[0:cut.rstrip().rindex(" ")]
+            parts = [current, cut] if current else [cut]
+            pieces += parts
+            current = ""
+            sentence = sentence[len(cut):].lstrip()
+        if len(sentence) == 0:
+            continue
+        candidate = f'{current} {sentence}' if current else sentence
+        if len(candidate.encode("utf-8")) <= max_bytes:
+            current = candidate
+        else:
+            pieces.append(current)
+            current = sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+@cache_lib.memoize('translation')
+def translate_text_piece(text, source, target='en-US'):
+    response = translate.translate_text(Text=text, SourceLanguageCode=source,TargetLanguageCode=target)
+    return response.get("TranslatedText")
+
+def iter_translate_text(text, source, target='en-US'):
+    # Translate long text as concurrent requests under the Translate size limit,
+    # yielding the translated pieces in order as soon as each one is ready
+    pieces = split_text_by_bytes(text)
+    if len(pieces) <= 1:
+        yield translate_text_piece(text, source, target)
+        return
+    with ThreadPoolExecutor(max_workers=TRANSLATE_MAX_PARALLEL_REQUESTS) as executor:
+        futures = [executor.submit(translate_text_piece, piece, source, target) for piece in pieces]
+        for future in futures:
+            yield future.result()
 
 def translate_text(text, source, target='en-US'):
     if source not in SUPPORTED_LANGUAGE:
         return None
-    response = translate.translate_text(Text=text, SourceLanguageCode=source,TargetLanguageCode=target)
-    return response.get("TranslatedText")
+    return " ".join(iter_translate_text(text, source, target))
 
+@cache_lib.memoize('toxicity')
 def detect_toxicity(text):
     response = comprehend.detect_toxic_content(
         TextSegments=[
@@ -163,6 +418,7 @@ def detect_toxicity(text):
 
     return result
 
+@cache_lib.memoize('language')
 def detect_language(text):
     response = comprehend.detect_dominant_language(
         Text=text,
@@ -172,6 +428,42 @@ def detect_language(text):
 
     return None
 
+
+def detect_toxicity_batch(texts):
+    # Same result shape as detect_toxicity, scoring up to 10 segments per Comprehend call
+    results = []
+    for i in range(0, len(texts), COMPREHEND_TOXICITY_BATCH_SIZE):
+        batch = texts[i:i + COMPREHEND_TOXICITY_BATCH_SIZE]
+        response = comprehend.detect_toxic_content(
+            TextSegments=[{"Text": t} for t in batch],
+            LanguageCode='en'
+        )
+        result_list = response.get("ResultList", []) if response is not None else []
+        for idx, text in enumerate(batch):
+            result = {"text": text, "categories": {}}
+            if idx < len(result_list):
+                result["toxicity"] = result_list[idx].get("Toxicity")
+                for r in result_list[idx]["Labels"]:
+                    result["categories"][r["Name"]] = r["Score"]
+            results.append(result)
+    return results
+
+def truncate_bytes(text, max_bytes):
+    return text.encode("utf-8")[0:max_bytes].decode("utf-8", errors="ignore")
+
+def detect_language_batch(texts):
+    # A document over the size limit would fail the whole batch, so each one is cut to its first bytes
+    codes = []
+    for i in range(0, len(texts), COMPREHEND_LANGUAGE_BATCH_SIZE):
+        batch = [truncate_bytes(t, COMPREHEND_LANGUAGE_MAX_BYTES) for t in texts[i:i + COMPREHEND_LANGUAGE_BATCH_SIZE]]
+        response = comprehend.batch_detect_dominant_language(TextList=batch)
+        batch_codes = [None] * len(batch)
+        for r in response.get("ResultList", []):
+            if len(r.get("Languages", [])) > 0:
+                batch_codes[r["Index"]] = r["Languages"][0]["LanguageCode"]
+        codes += batch_codes
+    return codes
+
 def parse_value(text, key):
     arr = text.split(f'<{key}>')
     if len(arr) > 1:
@@ -180,8 +472,32 @@ def parse_value(text, key):
             return arr2[0]
     return None
 
-def call_bedrock_knowledge_base(message, prompts_template):
-    model_arn = f'arn:aws:bedrock:{AWS_REGION}::foundation-model/{BEDROCK_MODEL_ID}'
+def policy_categories(category_scores):
+    # Upper-cased toxicity categories scoring at least POLICY_CATEGORY_MIN_SCORE in any of the score dicts
+    active = set()
+    for scores in category_scores:
+        for name, score in (scores or {}).items():
+            if score is not None and score >= POLICY_CATEGORY_MIN_SCORE:
+                active.add(name.upper())
+    return sorted(active)
+
+def retrieve_policy_references(message, number_of_results=3, categories=None):
+    # With categories, search the matching policy documents first and fall back to the whole corpus
+    if categories:
+        references = search_policy_references(message, number_of_results, categories + [POLICY_GENERAL_CATEGORY])
+        if len(references) > 0:
+            return references
+    return search_policy_references(message, number_of_results)
+
+def search_policy_references(message, number_of_results=3, categories=None):
+    if POLICY_RETRIEVAL_BACKEND == "local":
+        return [Reference(r["text"], r["s3_location"]) for r in retrieval_lib.retrieve(message, number_of_results, categories)]
+
+    search_configuration = {
+        "numberOfResults": number_of_results
+    }
+    if categories:
+        search_configuration["filter"] = {"in": {"key": POLICY_CATEGORY_KEY, "value": categories}}
 
     # Call bedrock knowledge base to retrieve references
     response = bedrock_agent_runtime_client.retrieve(
@@ -190,34 +506,214 @@ def call_bedrock_knowledge_base(message, prompts_template):
             'text': message
         },
         retrievalConfiguration={
-            "vectorSearchConfiguration": {
-                "numberOfResults": 3
-            }
+            "vectorSearchConfiguration": search_configuration
         }
     )
     retrieval_results = response.get("retrievalResults",[])
-    policy = ""
-    for r in retrieval_results:
-        policy += f'\n{r["content"]["text"]}'
+
+    references, seen = [], set()
+    for c in retrieval_results:
+        r = Reference(c['content']['text'], c['location']['s3Location']['uri'])
+        if r not in seen:
+            seen.add(r)
+            references.append(r)
+    return references
+
+def call_bedrock_knowledge_base(message, prompts_template, category_scores=()):
+    # category_scores: toxicity category score dicts of the evaluated text, used by POLICY_CATEGORY_FILTER
+    categories = policy_categories(category_scores) if POLICY_CATEGORY_FILTER else None
+    references = retrieve_policy_references(message[0:RETRIEVAL_QUERY_CHAR_LIMIT], categories=categories)
+    policy = "".join(f'\n{r.text}' for r in references)
 
     # Call Bedrock LLM to evaluate
     prompt = prompts_template.format(message=message, policy=policy)
     analysis,answer = call_bedrock_llm(prompt)
 
-    references = []
-    for c in retrieval_results:
-        r = {
-                'text':c['content']['text'],
-                's3_location': c['location']['s3Location']['uri']
-            }
-        if r not in references:
-            references.append(r)
+    return LlmResult.create(answer, analysis, references)
+
+def evaluate_text(txt, prompt_template, threshold, enable_toxicity_dependency=True):
+    # Language detection, translation, toxicity and policy evaluation of one text message
+    item = TextItem(txt)
+    txt_en = txt
+
+    # Detect language
+    lang_code = detect_language(txt)
+    item.raw_language_code = lang_code
+    lcode = lang_code[0:2].lower()
+
+    # Translate to English
+    if not lcode.startswith('en'):
+        translated_text = translate_text(txt,lcode)
+        if translated_text is None:
+            item.error = f'Unsupported language detected: {lang_code}'
+            return item
+        txt_en = translated_text
+        item.translated_text = translated_text
+
+    chunks = [c.strip() for c in chunk_text(txt_en) if len(c.strip()) > 0]
+    high_risk, categories = [], []
+    for chunk in chunks:
+        # Comprehend Toxicity Analysis
+        c_result = detect_toxicity(chunk)
+        if item.toxicity is None or item.toxicity.toxicity < c_result["toxicity"]:
+            item.toxicity = Toxicity.from_dict(c_result)
+        high_risk.append(c_result["toxicity"] >= threshold)
+        categories.append(c_result.get("categories"))
+
+    for window in plan_llm_windows(chunks, high_risk):
+        # Toxicity dependency enabled: only run LLMs when toxicity score greater than threshold
+        if enable_toxicity_dependency and not high_risk[window[0]]:
+            continue
+        # LLM evaluation
+        response = call_bedrock_knowledge_base(" ".join(chunks[i] for i in window), prompt_template, [categories[i] for i in window])
+        if item.llm is None:
+            item.llm = response
+        else:
+            item.llm.merge(response)
+
+    return item
+
+def parse_values_by_id(text, key):
+    # Values of <key id="...">...</key> tags, keyed by id
+    if text is None:
+        return {}
+    return {m[0]: m[1].strip() for m in re.findall(rf'<{key} id="?([\w-]+)"?>(.*?)</{key}>', text, re.DOTALL)}
+
+def call_bedrock_knowledge_base_batch(messages, prompts_template=constants.TEXT_BATCH_EVAL_PROMPTS_TEMPLATE, category_scores=None):
+    # Evaluate several short messages with one retrieval and one packed LLM call.
+    # Messages without a parseable answer fall back to individual evaluation.
+    if len(messages) == 0:
+        return []
+    category_scores = category_scores or [None] * len(messages)
+    if len(messages) == 1:
+        return [call_bedrock_knowledge_base(messages[0], constants.TEXT_EVAL_PROMPTS_TEMPLATE, category_scores[0:1])]
+
+    # One retrieval for the whole batch, filtered by the categories of any of its messages
+    categories = policy_categories(category_scores) if POLICY_CATEGORY_FILTER else None
+    references = retrieve_policy_references("\n".join(messages)[0:RETRIEVAL_QUERY_CHAR_LIMIT], categories=categories)
+    policy = "".join(f'\n{r.text}' for r in references)
+    packed = "\n".join(f'<message id="{idx}">{m}</message>' for idx, m in enumerate(messages))
+    completion = invoke_bedrock_model(prompts_template.format(messages=packed, policy=policy),
+                                      max_tokens=max(LLM_MAX_TOKENS, LLM_BATCH_TOKENS_PER_MESSAGE * len(messages)))
+    analyses = parse_values_by_id(completion, "analysis")
+    answers = parse_values_by_id(completion, "answer")
+
+    responses = []
+    for idx, message in enumerate(messages):
+        answer = answers.get(str(idx))
+        if answer not in ("Y", "N"):
+            responses.append(call_bedrock_knowledge_base(message, constants.TEXT_EVAL_PROMPTS_TEMPLATE, category_scores[idx:idx + 1]))
+            continue
+        responses.append(LlmResult.create(answer, analyses.get(str(idx)), references))
+    return responses
+
+def evaluate_text_batch(texts, threshold, enable_toxicity_dependency=True):
+    # Batched counterpart of evaluate_text for short chat messages, returning items in the same shape
+    items = [TextItem(t) for t in texts]
+    english = []
+    for item, txt, lang_code in zip(items, texts, detect_language_batch(texts)):
+        item.raw_language_code = lang_code
+        lcode = (lang_code or "en")[0:2].lower()
+        if not lcode.startswith('en'):
+            translated_text = translate_text(txt, lcode)
+            if translated_text is None:
+                item.error = f'Unsupported language detected: {lang_code}'
+                english.append(None)
+                continue
+            item.translated_text = translated_text
+            txt = translated_text
+        english.append(txt)
+
+    # Long messages are scored on their most toxic chunk
+    chunks, owners = [], []
+    for idx, txt in enumerate(english):
+        if txt is None:
+            continue
+        for chunk in chunk_text(txt):
+            chunk = chunk.strip()
+            if len(chunk) > 0:
+                chunks.append(chunk)
+                owners.append(idx)
+    for idx, result in zip(owners, detect_toxicity_batch(chunks)):
+        current = items[idx].toxicity
+        if current is None or (current.toxicity or 0) < (result.get("toxicity") or 0):
+            items[idx].toxicity = Toxicity.from_dict(result)
+
+    to_evaluate = [
+        idx for idx, item in enumerate(items)
+        if english[idx] is not None and (not enable_toxicity_dependency or (item.toxicity is not None and (item.toxicity.toxicity or 0) >= threshold))
+    ]
+    category_scores = [items[i].toxicity.category_scores() if items[i].toxicity else None for i in to_evaluate]
+    for idx, response in zip(to_evaluate, call_bedrock_knowledge_base_batch([english[i] for i in to_evaluate], category_scores=category_scores)):
+        items[idx].llm = response
+    return items
+
+def schedule_segments(transcriptions, threshold, enable_toxicity_dependency=True):
+    # Return indexes of the segments that qualify for LLM evaluation
+    return [
+        idx for idx, tran in enumerate(transcriptions)
+        if not enable_toxicity_dependency or (tran.get("toxicity") or 0) > threshold
+    ]
 
-    return {
-        "answer":answer,
-        "analysis":analysis,
-        "references":references
-    }
+def evaluate_segments(transcriptions, prompt_template, threshold, enable_toxicity_dependency=True, riskiest_first=False, stop_on_violation=False, max_llm_calls=LLM_MAX_CALLS_PER_FILE):
+    # Run policy evaluation on the scheduled segments, merging adjacent low-risk segments into windows.
+    # Returns per-segment LLM responses and statuses (evaluated, evaluated_in_window, below_threshold,
+    # skipped_after_violation, skipped_budget), the file verdict (True on any violation, False if every
+    # scheduled segment was evaluated and none violates, None otherwise) and the number of LLM calls made.
+    responses = [None] * len(transcriptions)
+    statuses = ["below_threshold"] * len(transcriptions)
+    violation = None
+    calls = 0
+    budget_exhausted = False
+
+    scheduled = set(schedule_segments(transcriptions, threshold, enable_toxicity_dependency))
+    high_risk = [(t.get("toxicity") or 0) > threshold for t in transcriptions]
+    windows = [w for w in plan_llm_windows([t["text"] for t in transcriptions], high_risk) if w[0] in scheduled]
+    if riskiest_first:
+        windows.sort(key=lambda w: max(transcriptions[i].get("toxicity") or 0 for i in w), reverse=True)
+
+    def evaluate_window(members):
+        text = " ".join(transcriptions[i]["text"] for i in members)
+        return call_bedrock_knowledge_base(text, prompt_template, [transcriptions[i].get("categories") for i in members])
+
+    def assign(members, response):
+        # Bisect a violating window until the violating segments are evaluated on their own
+        nonlocal calls
+        for idx in members:
+            responses[idx] = response
+            statuses[idx] = "evaluated" if len(members) == 1 else "evaluated_in_window"
+        if len(members) == 1 or response.answer != "Y":
+            return
+        half = len(members) // 2
+        for part in (members[0:half], members[half:]):
+            if max_llm_calls and calls >= max_llm_calls:
+                return
+            calls += 1
+            assign(part, evaluate_window(part))
+
+    for window in windows:
+        if stop_on_violation and violation:
+            for idx in window:
+                statuses[idx] = "skipped_after_violation"
+            continue
+        if max_llm_calls and calls >= max_llm_calls:
+            for idx in window:
+                statuses[idx] = "skipped_budget"
+            budget_exhausted = True
+            continue
+
+        calls += 1
+        assign(window, evaluate_window(window))
+
+        if any(responses[idx].answer == "Y" for idx in window):
+            violation = True
+        elif violation is None:
+            violation = False
+
+    # Segments the budget skipped could still violate
+    if budget_exhausted and not violation:
+        violation = None
+    return responses, statuses, violation, calls
 
 def detect_celebrity_video(s3_bucket, s3_key):
     startCelebrityRekognition = rekognition.start_celebrity_recognition(
@@ -258,10 +754,66 @@ def detect_celebrity_video(s3_bucket, s3_key):
 
     return result
 
-def call_bedrock_llm(prompt):
+llm_stats = {}
+llm_stats_lock = threading.Lock()
+
+def record_llm_call(model_id, seconds, escalated=False):
+    with llm_stats_lock:
+        stats = llm_stats.setdefault(model_id, {"calls": 0, "escalated": 0, "latency": deque(maxlen=LLM_LATENCY_SAMPLES)})
+        stats["calls"] += 1
+        stats["latency"].append(seconds)
+        if escalated:
+            stats["escalated"] += 1
+
+def get_llm_stats():
+    # Calls, escalation rate and latency percentiles (over the latest calls) per model
+    summary = {}
+    with llm_stats_lock:
+        for model_id, stats in llm_stats.items():
+            latency = sorted(stats["latency"])
+            summary[model_id] = {
+                "calls": stats["calls"],
+                "escalated": stats["escalated"],
+                "escalation_rate": round(stats["escalated"] / stats["calls"], 4),
+                "p50_ms": round(latency[int(0.5 * (len(latency) - 1))] * 1000, 1),
+                "p90_ms": round(latency[int(0.9 * (len(latency) - 1))] * 1000, 1),
+            }
+    return summary
+
+def get_region_stats():
+    # Calls, throttling, failovers and routing state per region of each multi-region client
+    return {name: client.status() for name, client in (("translate", translate), ("comprehend", comprehend), ("bedrock-runtime", bedrock_runtime))
+            if isinstance(client, region_lib.RegionPool)}
+
+def reset_llm_stats():
+    with llm_stats_lock:
+        llm_stats.clear()
+
+def invoke_bedrock_messages(prompt, model_id):
+    # The prompt templates are written for the text completion API; the messages API takes the bare turn
+    text = prompt.replace("Human:", "", 1).rsplit("Assistant:", 1)[0].strip()
+    body = json.dumps({
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": LLM_MAX_TOKENS,
+            "temperature": 0,
+            "messages": [{"role": "user", "content": [{"type": "text", "text": text}]}]
+            })
+    start = time.perf_counter()
+    response = bedrock_runtime.invoke_model(
+        body=body,
+        contentType='application/json',
+        accept='application/json',
+        modelId=model_id
+    )
+    content = json.loads(response.get('body').read()).get("content", [])
+    return "".join(c.get("text", "") for c in content if c.get("type", "text") == "text"), time.perf_counter() - start
+
+def invoke_bedrock_model(prompt, model_id=None, max_tokens=LLM_MAX_TOKENS):
+    model_id = model_id or BEDROCK_MODEL_ID
+    start = time.perf_counter()
     body = json.dumps({
             "prompt": prompt,
-            "max_tokens_to_sample": 300,
+            "max_tokens_to_sample": max_tokens,
             "temperature": 0,
             "top_k": 250,
             "top_p": 0.999
@@ -270,10 +822,52 @@ def call_bedrock_llm(prompt):
         body=body,
         contentType='application/json',
         accept='application/json',
-        modelId=BEDROCK_MODEL_ID
+        modelId=model_id
     )
 
-    response_text = json.loads(response.get('body').read()).get("completion")
+    completion = json.loads(response.get('body').read()).get("completion")
+    record_llm_call(model_id, time.perf_counter() - start)
+    return completion
+
+def parse_confidence(text):
+    try:
+        return float(parse_value(text, "confidence"))
+    except (TypeError, ValueError):
+        return None
+
+def call_fast_llm(prompt, model_id=None, escalation_confidence=None):
+    # Returns (analysis, answer), or None when the verdict needs the larger model
+    model_id = model_id or BEDROCK_FAST_MODEL_ID
+    escalation_confidence = LLM_ESCALATION_CONFIDENCE if escalation_confidence is None else escalation_confidence
+    start = time.perf_counter()
+    try:
+        response_text, seconds = invoke_bedrock_messages(prompt.rsplit("Assistant:", 1)[0] + constants.CONFIDENCE_PROMPT_SUFFIX, model_id)
+    except ClientError as e:
+        print(f"Fast model {model_id} failed, escalating: {e}")
+        # A failed call counts as an escalation, so the escalation rate includes failures
+        record_llm_call(model_id, time.perf_counter() - start, True)
+        return None
+    answer = (parse_value(response_text, "answer") or "").strip()
+    confidence = parse_confidence(response_text)
+    escalate = answer not in ("Y", "N") or confidence is None or confidence < escalation_confidence
+    record_llm_call(model_id, seconds, escalate)
+    if escalate:
+        return None
+    return parse_value(response_text, "analysis"), answer
+
+def call_bedrock_llm(prompt):
+    return call_llm_cascade(prompt, BEDROCK_MODEL_ID, BEDROCK_FAST_MODEL_ID, LLM_ESCALATION_CONFIDENCE)
+
+# The models and escalation threshold are part of the cache key, so changing them does not reuse old verdicts.
+# Verdicts without an answer (truncated or unparseable output) are not cached, so a rerun retries them.
+@cache_lib.memoize('llm', cacheable=lambda verdict: verdict[1] is not None)
+def call_llm_cascade(prompt, model_id, fast_model_id, escalation_confidence):
+    if fast_model_id:
+        verdict = call_fast_llm(prompt, fast_model_id, escalation_confidence)
+        if verdict is not None:
+            return verdict
+
+    response_text = invoke_bedrock_model(prompt, model_id)
     analysis = parse_value(response_text,"analysis")
     answer = parse_value(response_text,"answer")
 
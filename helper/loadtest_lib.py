@@ -0,0 +1,119 @@
+import os
+import random
+from io import BytesIO
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+
+from helper import lib
+from helper import constants
+from helper import result_lib
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".mp4", ".flac", ".ogg", ".amr", ".webm", ".m4a")
+
+def text_workload(file_path):
+    # Chat messages replayed from a TXT or CSV file (first column)
+    file_type = "csv" if file_path.lower().endswith(".csv") else "txt"
+    with open(file_path, "rb") as f:
+        for _, txt in lib.iter_text_rows(f, file_type):
+            if len(txt.strip()) > 0:
+                yield txt.strip()
+
+def audio_workload(folder):
+    # Audio files are replayed end to end as (name, bytes); stored audio reports replay the evaluation of their segments
+    for name in sorted(os.listdir(folder)):
+        file_path = os.path.join(folder, name)
+        if not os.path.isfile(file_path):
+            continue
+        if name.endswith(".json"):
+            report = result_lib.load(file_path)
+            yield [s.transcription.to_dict() for s in report.segments]
+        elif name.lower().endswith(AUDIO_EXTENSIONS):
+            with open(file_path, "rb") as f:
+                yield name, f.read()
+
+def text_handler(threshold, enable_toxicity_dependency=True, prompt_template=constants.TEXT_EVAL_PROMPTS_TEMPLATE):
+    def handle(txt):
+        return lib.evaluate_text(txt, prompt_template, threshold, enable_toxicity_dependency)
+    return handle
+
+def audio_handler(threshold, enable_toxicity_dependency=True, prompt_template=constants.TEXT_EVAL_PROMPTS_TEMPLATE):
+    def handle(payload):
+        transcriptions = payload
+        if isinstance(payload, tuple):
+            # Upload, transcription job and polling, as the audio page runs them
+            name, data = payload
+            upload = BytesIO(data)
+            upload.name = name
+            s3_bucket, s3_key = lib.upload_to_s3(upload)
+            _, transcriptions = lib.transcribe_audio(s3_bucket, s3_key)
+        return lib.evaluate_segments(transcriptions, prompt_template, threshold, enable_toxicity_dependency)
+    return handle
+
+def run_open_loop(workload, handler, rate, max_requests=None, duration=None, max_workers=64, seed=None, loop=True):
+    # Issue requests with Poisson arrivals at `rate` per second regardless of completions (open loop).
+    # Requests wait in the executor queue when all workers are busy, which shows up as queueing delay.
+    payloads = list(workload)
+    if len(payloads) == 0:
+        return summarize([], 0)
+    rng = random.Random(seed)
+    records = []
+    lock = threading.Lock()
+
+    def run(payload, scheduled):
+        started = time.perf_counter()
+        error = None
+        try:
+            handler(payload)
+        except Exception as e:
+            error = type(e).__name__
+        finished = time.perf_counter()
+        with lock:
+            records.append((scheduled, started, finished, error))
+
+    futures = []
+    start = time.perf_counter()
+    next_arrival = start
+    idx = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            if max_requests is not None and idx >= max_requests:
+                break
+            if duration is not None and next_arrival - start >= duration:
+                break
+            if idx >= len(payloads) and not loop:
+                break
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(run, payloads[idx % len(payloads)], next_arrival))
+            idx += 1
+            next_arrival += rng.expovariate(rate)
+        wait(futures)
+    return summarize(records, time.perf_counter() - start, rate)
+
+def summarize(records, elapsed, rate=None):
+    if len(records) == 0:
+        return {"requests": 0}
+    data = np.array([(r[0], r[1], r[2]) for r in records])
+    latency = (data[:, 2] - data[:, 0]) * 1000
+    service = (data[:, 2] - data[:, 1]) * 1000
+    queueing = (data[:, 1] - data[:, 0]) * 1000
+    errors = {}
+    for r in records:
+        if r[3] is not None:
+            errors[r[3]] = errors.get(r[3], 0) + 1
+    return {
+        "requests": len(records),
+        "target_rate": rate,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput": round(len(records) / elapsed, 3),
+        "errors": errors,
+        "latency_ms": {"p50": round(float(np.percentile(latency, 50)), 1), "p99": round(float(np.percentile(latency, 99)), 1), "max": round(float(latency.max()), 1)},
+        "service_ms": {"p50": round(float(np.percentile(service, 50)), 1), "p99": round(float(np.percentile(service, 99)), 1)},
+        "queueing_ms": {"p50": round(float(np.percentile(queueing, 50)), 1), "p99": round(float(np.percentile(queueing, 99)), 1), "mean": round(float(queueing.mean()), 1)},
+    }
+
+def client_stats(fakes):
+    return {name: {"calls": f.calls, "throttled": f.throttled, "failed": f.failed} for name, f in fakes.items()}
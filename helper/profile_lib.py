@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import cProfile
+import pstats
+import threading
+import contextlib
+
+PROFILE_EVALUATION = os.environ.get('PROFILE_EVALUATION', 'false').lower() == 'true'
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+PROFILE_TOP_N = 25
+# Where the headless tools (tools/load_test.py, services/chat_service.py) write their profiles
+PROFILE_FOLDER = os.environ.get('PROFILE_FOLDER', 'data/profiles/')
+
+class StackSampler(threading.Thread):
+    # Samples the wall-clock call stack of one thread, or of every other thread when thread_id is None,
+    # so time spent waiting on the network shows up too
+    def __init__(self, thread_id, interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            if self.thread_id is not None:
+                frames = {self.thread_id: frames.get(self.thread_id)}
+            for thread_id, frame in frames.items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write_collapsed(self, file_path):
+        # Brendan Gregg's collapsed stack format, readable by flamegraph.pl and speedscope
+        with open(file_path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+class ProfileSession:
+    def __init__(self, output_prefix):
+        self.output_prefix = output_prefix
+        self.profile_path = f'{output_prefix}.prof'
+        self.collapsed_path = f'{output_prefix}.collapsed'
+        self.elapsed = None
+        self.hotspots = []
+
+def hotspots(profiler, top_n=PROFILE_TOP_N):
+    # Functions with the most own time, with call counts and cumulative time
+    stats = pstats.Stats(profiler).stats
+    rows = []
+    for (file_name, line, func), (cc, nc, tt, ct, callers) in stats.items():
+        location = func if file_name == '~' else f'{os.path.basename(file_name)}:{line}({func})'
+        rows.append({"function": location, "calls": nc, "own_s": round(tt, 4), "cumulative_s": round(ct, 4)})
+    rows.sort(key=lambda r: r["own_s"], reverse=True)
+    return rows[0:top_n]
+
+@contextlib.contextmanager
+def profile_run(output_prefix, enabled=PROFILE_EVALUATION, all_threads=False):
+    # Profile the enclosed block with cProfile and a stack sampler, writing <prefix>.prof and <prefix>.collapsed.
+    # cProfile only sees the calling thread; with all_threads the sampler also records every other thread,
+    # e.g. the executor workers of a headless run. Leave it off in the shared Streamlit server.
+    if not enabled:
+        yield None
+        return
+
+    folder = os.path.dirname(output_prefix)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    session = ProfileSession(output_prefix)
+    profiler = cProfile.Profile()
+    sampler = StackSampler(None if all_threads else threading.get_ident())
+    start = time.perf_counter()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield session
+    finally:
+        profiler.disable()
+        sampler.stop()
+        session.elapsed = time.perf_counter() - start
+        profiler.dump_stats(session.profile_path)
+        sampler.write_collapsed(session.collapsed_path)
+        session.hotspots = hotspots(profiler)
+        print(f"Profile saved: {session.profile_path}, {session.collapsed_path}")
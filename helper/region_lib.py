@@ -0,0 +1,140 @@
+import os
+import random
+import threading
+import time
+import boto3
+from botocore.exceptions import ClientError, EndpointConnectionError, ConnectionClosedError, ConnectTimeoutError, ReadTimeoutError
+
+from helper.batch_lib import THROTTLING_ERRORS
+
+# Regions to spread stateless calls across, as "region" or "region:weight", e.g. "us-east-1:2,us-west-2,eu-central-1".
+# Defaults to AWS_REGION, then the session's region (AWS_DEFAULT_REGION or the profile) like the other clients,
+# which keeps the single-region behaviour.
+AWS_REGIONS = os.environ.get('AWS_REGIONS') or os.environ.get('AWS_REGION') or boto3.session.Session().region_name or 'us-east-1'
+# A region is taken out of rotation for this long after REGION_FAILURE_THRESHOLD consecutive errors
+REGION_COOLDOWN_SECONDS = float(os.environ.get('REGION_COOLDOWN_SECONDS', 30))
+REGION_FAILURE_THRESHOLD = 3
+# Throttling halves a region's share of traffic down to this fraction of its weight; successes restore it
+REGION_MIN_HEALTH = 1 / 16
+REGION_HEALTH_RECOVERY = 0.1
+SERVER_ERRORS = ('InternalServerException', 'InternalFailure', 'ServiceUnavailableException', 'ServiceUnavailable',
+                 'ModelNotReadyException', 'ModelTimeoutException')
+# Errors reaching the regional endpoint; other botocore errors (bad parameters, missing credentials) are not regional
+CONNECTION_ERRORS = (EndpointConnectionError, ConnectionClosedError, ConnectTimeoutError, ReadTimeoutError)
+
+def parse_regions(value=AWS_REGIONS):
+    # "us-east-1:2,us-west-2" -> {"us-east-1": 2.0, "us-west-2": 1.0}
+    regions = {}
+    for part in value.split(","):
+        part = part.strip()
+        if len(part) == 0:
+            continue
+        name, _, weight = part.partition(":")
+        regions[name.strip()] = float(weight) if weight else 1.0
+    return regions
+
+def error_kind(e):
+    # "throttled" and "failed" errors are retried in another region; anything else is the caller's problem
+    if isinstance(e, ClientError):
+        code = e.response.get("Error", {}).get("Code")
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        if code in THROTTLING_ERRORS or status == 429:
+            return "throttled"
+        if code in SERVER_ERRORS or status >= 500:
+            return "failed"
+        return None
+    if isinstance(e, CONNECTION_ERRORS):
+        return "failed"
+    return None
+
+class RegionPool:
+    # Drop-in stand-in for one boto3 client that routes each call to one of several regional clients.
+    # Regions are picked at random in proportion to weight * health; health is halved on throttling and
+    # recovers on success, and a region with REGION_FAILURE_THRESHOLD consecutive errors cools down for
+    # REGION_COOLDOWN_SECONDS. A throttled or failed call fails over to the remaining regions and the
+    # last error is raised only when every region has been tried.
+    def __init__(self, service, clients, weights=None, seed=None):
+        self.service = service
+        self.clients = clients
+        self.weights = {region: (weights or {}).get(region, 1.0) for region in clients}
+        self.health = {region: 1.0 for region in clients}
+        self.consecutive_errors = {region: 0 for region in clients}
+        self.cooldown_until = {region: 0.0 for region in clients}
+        self.stats = {region: {"calls": 0, "throttled": 0, "failed": 0, "failovers": 0} for region in clients}
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __getattr__(self, operation):
+        # Only reached for names that are not pool attributes, i.e. client operations
+        clients = self.__dict__.get("clients")
+        if operation.startswith("_") or not clients or not hasattr(next(iter(clients.values())), operation):
+            raise AttributeError(operation)
+        return lambda **kwargs: self.call(operation, **kwargs)
+
+    def route(self):
+        # Regions in the order to try them: a weighted random draw without replacement among the
+        # available regions, followed by cooling-down regions soonest-back first as a last resort
+        with self.lock:
+            now = time.monotonic()
+            available = [r for r in self.clients if self.cooldown_until[r] <= now]
+            cooling = sorted((r for r in self.clients if self.cooldown_until[r] > now), key=self.cooldown_until.get)
+            shares = {r: self.weights[r] * self.health[r] for r in available}
+            order = []
+            while shares:
+                pick = self.rng.uniform(0, sum(shares.values()))
+                for region, share in shares.items():
+                    pick -= share
+                    if pick <= 0:
+                        break
+                order.append(region)
+                del shares[region]
+        return order + cooling
+
+    def record(self, region, kind):
+        with self.lock:
+            stats = self.stats[region]
+            stats["calls"] += 1
+            if kind is None:
+                self.consecutive_errors[region] = 0
+                self.health[region] = min(1.0, self.health[region] + REGION_HEALTH_RECOVERY)
+                return
+            stats[kind] += 1
+            if kind == "throttled":
+                self.health[region] = max(REGION_MIN_HEALTH, self.health[region] / 2)
+            self.consecutive_errors[region] += 1
+            if self.consecutive_errors[region] >= REGION_FAILURE_THRESHOLD:
+                print(f"{self.service} in {region} cooling down for {REGION_COOLDOWN_SECONDS}s after {self.consecutive_errors[region]} errors")
+                self.cooldown_until[region] = time.monotonic() + REGION_COOLDOWN_SECONDS
+                self.consecutive_errors[region] = 0
+
+    def call(self, operation, **kwargs):
+        last_error = None
+        for region in self.route():
+            if last_error is not None:
+                with self.lock:
+                    self.stats[region]["failovers"] += 1
+            try:
+                response = getattr(self.clients[region], operation)(**kwargs)
+            except Exception as e:
+                kind = error_kind(e)
+                if kind is None:
+                    raise
+                self.record(region, kind)
+                last_error = e
+                continue
+            self.record(region, None)
+            return response
+        raise last_error
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                region: dict(self.stats[region], weight=self.weights[region], health=round(self.health[region], 3),
+                             cooling_down=self.cooldown_until[region] > now)
+                for region in self.clients
+            }
+
+def make_pool(service, regions=None):
+    regions = regions or parse_regions()
+    return RegionPool(service, {region: boto3.client(service, region_name=region) for region in regions}, regions)
@@ -0,0 +1,279 @@
+import json
+import math
+from array import array
+from dataclasses import dataclass, field
+from typing import NamedTuple
+
+# Version of the serialized report format written by dumps(); loads() also reads unversioned legacy reports
+RESULT_FORMAT_VERSION = 1
+TOXICITY_CATEGORIES = ['PROFANITY', 'HATE_SPEECH', 'SEXUAL', 'INSULT', 'VIOLENCE_OR_THREAT', 'GRAPHIC', 'HARASSMENT_OR_ABUSE']
+CATEGORY_INDEX = {c: i for i, c in enumerate(TOXICITY_CATEGORIES)}
+
+def new_category_scores():
+    # One float per category in TOXICITY_CATEGORIES order, NaN when the category was not scored
+    return array('d', [math.nan]) * len(TOXICITY_CATEGORIES)
+
+class Reference(NamedTuple):
+    # A tuple, so dedup sets and the serializer's reference table hash it in C
+    text: str
+    s3_location: str
+
+@dataclass(slots=True)
+class Toxicity:
+    text: str
+    toxicity: float = None
+    categories: array = field(default_factory=new_category_scores)
+    start_time: float = None
+    end_time: float = None
+
+    @classmethod
+    def from_dict(cls, data):
+        # Comprehend labels are upper case, Transcribe categories lower case
+        if data is None:
+            return None
+        categories = new_category_scores()
+        for name, score in (data.get("categories") or {}).items():
+            idx = CATEGORY_INDEX.get(name.upper())
+            if idx is not None and score is not None:
+                categories[idx] = score
+        start_time, end_time = data.get("start_time"), data.get("end_time")
+        return cls(data.get("text"), data.get("toxicity"), categories,
+                   None if start_time is None else float(start_time), None if end_time is None else float(end_time))
+
+    def category_scores(self):
+        return {c: s for c, s in zip(TOXICITY_CATEGORIES, self.categories) if not math.isnan(s)}
+
+    def to_dict(self):
+        data = {"text": self.text, "categories": self.category_scores()}
+        if self.toxicity is not None:
+            data["toxicity"] = self.toxicity
+        if self.start_time is not None:
+            data["start_time"] = self.start_time
+            data["end_time"] = self.end_time
+        return data
+
+@dataclass(slots=True)
+class LlmResult:
+    answer: str = None
+    analysis_parts: list = field(default_factory=list)
+    references: list = field(default_factory=list)
+    seen_references: set = field(default_factory=set, repr=False, compare=False)
+
+    @classmethod
+    def create(cls, answer, analysis, references):
+        result = cls(answer)
+        if analysis:
+            result.analysis_parts.append(analysis)
+        result.add_references(references)
+        return result
+
+    @classmethod
+    def from_dict(cls, data):
+        if data is None:
+            return None
+        references = [Reference(r["text"], r["s3_location"]) for r in data.get("references") or []]
+        return cls.create(data.get("answer"), data.get("analysis"), references)
+
+    @property
+    def analysis(self):
+        return "".join(self.analysis_parts)
+
+    def add_references(self, references):
+        for r in references:
+            if r not in self.seen_references:
+                self.seen_references.add(r)
+                self.references.append(r)
+
+    def merge(self, other):
+        # Combine the evaluation of another chunk of the same message: any violation wins
+        if other.answer == "Y":
+            self.answer = "Y"
+        self.analysis_parts.extend(other.analysis_parts)
+        self.add_references(other.references)
+
+    def to_dict(self):
+        return {
+            "answer": self.answer,
+            "analysis": self.analysis,
+            "references": [{"text": r.text, "s3_location": r.s3_location} for r in self.references]
+        }
+
+@dataclass(slots=True)
+class TextItem:
+    raw_text: str
+    translated_text: str = None
+    raw_language_code: str = None
+    toxicity: Toxicity = None
+    llm: LlmResult = None
+    error: str = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["raw_text"], data.get("translated_text"), data.get("raw_language_code"),
+                   Toxicity.from_dict(data.get("toxicity")), LlmResult.from_dict(data.get("llm")), data.get("error"))
+
+@dataclass(slots=True)
+class Segment:
+    transcription: Toxicity
+    llm_response: LlmResult = None
+    llm_status: str = None
+
+@dataclass(slots=True)
+class AudioReport:
+    full_transcription: str
+    segments: list = field(default_factory=list)
+    toxic_max: float = None
+    violation: bool = None
+    llm_calls: int = None
+    toxicity_source: str = None
+    s3_bucket: str = None
+    s3_key: str = None
+
+    @classmethod
+    def from_dict(cls, data):
+        s3_path = data.get("s3_path") or {}
+        segments = [
+            Segment(Toxicity.from_dict(t["transcription"]), LlmResult.from_dict(t.get("llm_response")), t.get("llm_status"))
+            for t in data.get("transcriptions") or []
+        ]
+        return cls(data.get("full_transcription"), segments, data.get("toxic_max"), data.get("violation"), data.get("llm_calls"),
+                   data.get("toxicity_source"), s3_path.get("s3_bucket"), s3_path.get("s3_key"))
+
+@dataclass(slots=True)
+class TextReport:
+    raw_content: str = None
+    evaluations: list = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("raw_content"), [TextItem.from_dict(i) for i in data.get("evaluations") or []])
+
+# Serialized form: rows are positional lists and each distinct policy reference is written once
+# in a report-level table that rows point into, since the same passages recur across segments.
+
+class ReferenceTable:
+    def __init__(self, rows=None):
+        self.references = [Reference(text, location) for text, location in rows or ()]
+        self.ids = {}
+
+    def encode(self, llm):
+        ids = []
+        for r in llm.references:
+            idx = self.ids.get(r)
+            if idx is None:
+                idx = self.ids[r] = len(self.references)
+                self.references.append(r)
+            ids.append(idx)
+        return ids
+
+    def decode(self, ids):
+        return [self.references[i] for i in ids]
+
+    def rows(self):
+        return [[r.text, r.s3_location] for r in self.references]
+
+def encode_toxicity(t):
+    if t is None:
+        return None
+    # NaN != NaN marks a category that was not scored
+    return [t.text, t.toxicity, [None if s != s else s for s in t.categories], t.start_time, t.end_time]
+
+def decode_toxicity(row):
+    if row is None:
+        return None
+    text, toxicity, scores, start_time, end_time = row
+    return Toxicity(text, toxicity, array('d', [math.nan if s is None else s for s in scores]), start_time, end_time)
+
+def encode_llm(llm, table):
+    if llm is None:
+        return None
+    return [llm.answer, llm.analysis_parts, table.encode(llm)]
+
+def decode_llm(row, table):
+    if row is None:
+        return None
+    answer, parts, ids = row
+    references = table.decode(ids)
+    # Written deduplicated, so the references go straight into place
+    return LlmResult(answer, parts, references, set(references))
+
+def encode_text_item(item, table):
+    return [item.raw_text, item.translated_text, item.raw_language_code,
+            encode_toxicity(item.toxicity), encode_llm(item.llm, table), item.error]
+
+def decode_text_item(row, table):
+    raw_text, translated_text, raw_language_code, toxicity, llm, error = row
+    return TextItem(raw_text, translated_text, raw_language_code, decode_toxicity(toxicity), decode_llm(llm, table), error)
+
+def encode_segment(segment, table):
+    return [encode_toxicity(segment.transcription), encode_llm(segment.llm_response, table), segment.llm_status]
+
+def decode_segment(row, table):
+    transcription, llm, status = row
+    return Segment(decode_toxicity(transcription), decode_llm(llm, table), status)
+
+def to_document(report):
+    table = ReferenceTable()
+    if isinstance(report, AudioReport):
+        document = {
+            "version": RESULT_FORMAT_VERSION,
+            "kind": "audio",
+            "full_transcription": report.full_transcription,
+            "toxic_max": report.toxic_max,
+            "violation": report.violation,
+            "llm_calls": report.llm_calls,
+            "toxicity_source": report.toxicity_source,
+            "s3_path": {"s3_bucket": report.s3_bucket, "s3_key": report.s3_key},
+            "segments": [encode_segment(s, table) for s in report.segments],
+        }
+    else:
+        document = {
+            "version": RESULT_FORMAT_VERSION,
+            "kind": "text",
+            "raw_content": report.raw_content,
+            "evaluations": [encode_text_item(i, table) for i in report.evaluations],
+        }
+    document["references"] = table.rows()
+    return document
+
+def from_document(document):
+    version = document.get("version")
+    if version is None:
+        # Legacy reports are the nested dicts the pages used to write
+        return AudioReport.from_dict(document) if "transcriptions" in document else TextReport.from_dict(document)
+    if version > RESULT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported report format version {version}, this app reads up to {RESULT_FORMAT_VERSION}")
+
+    table = ReferenceTable(document.get("references"))
+    if document["kind"] == "audio":
+        s3_path = document.get("s3_path") or {}
+        return AudioReport(document["full_transcription"], [decode_segment(r, table) for r in document["segments"]],
+                           document.get("toxic_max"), document.get("violation"), document.get("llm_calls"),
+                           document.get("toxicity_source"), s3_path.get("s3_bucket"), s3_path.get("s3_key"))
+    return TextReport(document.get("raw_content"), [decode_text_item(r, table) for r in document["evaluations"]])
+
+def dumps(report):
+    return json.dumps(to_document(report), ensure_ascii=False, separators=(",", ":"))
+
+def loads(data):
+    return from_document(json.loads(data))
+
+def save(report, file_path):
+    with open(file_path, "w") as json_file:
+        json_file.write(dumps(report))
+
+def load(file_path):
+    with open(file_path, "r") as json_file:
+        return loads(json_file.read())
+
+def encode_text_entry(item):
+    # Self-contained single item, e.g. one line of a checkpoint log
+    table = ReferenceTable()
+    row = encode_text_item(item, table)
+    return {"version": RESULT_FORMAT_VERSION, "item": row, "references": table.rows()}
+
+def decode_text_entry(entry):
+    # Accepts an entry written from encode_text_entry or one holding a legacy item dict
+    if "version" not in entry:
+        return TextItem.from_dict(entry["item"])
+    return decode_text_item(entry["item"], ReferenceTable(entry.get("references")))
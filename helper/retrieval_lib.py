@@ -0,0 +1,153 @@
+import os
+import re
+import json
+import threading
+import time
+from pathlib import Path
+import numpy as np
+
+POLICY_DOCS_FOLDER = os.environ.get('POLICY_DOCS_FOLDER', 'data/policies/')
+POLICY_INDEX_FILE = os.environ.get('POLICY_INDEX_FILE', 'data/policy_index.npz')
+POLICY_DOC_TYPES = ('.txt', '.md')
+# A loaded index is checked against the policy documents at most this often; 0 checks on every retrieval
+POLICY_INDEX_CHECK_SECONDS = float(os.environ.get('POLICY_INDEX_CHECK_SECONDS', 30))
+PASSAGE_CHAR_LIMIT = 1000
+# Same sidecar layout as Bedrock Knowledge Base: <document>.metadata.json with {"metadataAttributes": {"category": ...}}
+METADATA_SUFFIX = '.metadata.json'
+CATEGORY_KEY = 'category'
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_index = None
+_index_checked = 0.0
+_index_lock = threading.Lock()
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+def split_passages(text, char_limit=PASSAGE_CHAR_LIMIT):
+    # Group paragraphs into passages of up to char_limit characters
+    passages, current = [], ""
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if len(paragraph) == 0:
+            continue
+        if len(current) > 0 and len(current) + len(paragraph) > char_limit:
+            passages.append(current)
+            current = ""
+        current = f'{current}\n{paragraph}' if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+def list_policy_docs(folder=POLICY_DOCS_FOLDER):
+    if not os.path.exists(folder):
+        return []
+    return sorted(p for p in Path(folder).rglob('*') if p.is_file() and p.suffix.lower() in POLICY_DOC_TYPES)
+
+def metadata_path(doc):
+    return doc.with_name(doc.name + METADATA_SUFFIX)
+
+def read_category(doc):
+    # Upper-cased category attribute of a policy document, "" when it has no sidecar
+    try:
+        with open(metadata_path(doc), "r") as f:
+            category = json.load(f).get("metadataAttributes", {}).get(CATEGORY_KEY)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return ""
+    return str(category or "").upper()
+
+def build_index(folder=POLICY_DOCS_FOLDER, index_file=POLICY_INDEX_FILE):
+    passages, locations, categories = [], [], []
+    for doc in list_policy_docs(folder):
+        category = read_category(doc)
+        for passage in split_passages(doc.read_text(encoding="utf-8")):
+            passages.append(passage)
+            locations.append(doc.resolve().as_uri())
+            categories.append(category)
+
+    tokens = [tokenize(p) for p in passages]
+    vocab = sorted(set(t for ts in tokens for t in ts))
+    term_ids = {t: i for i, t in enumerate(vocab)}
+    tf = np.zeros((len(passages), len(vocab)), dtype=np.float32)
+    for row, ts in enumerate(tokens):
+        ids, counts = np.unique([term_ids[t] for t in ts], return_counts=True)
+        tf[row, ids] = counts
+
+    df = np.count_nonzero(tf, axis=0)
+    index = {
+        "passages": np.array(passages, dtype=object),
+        "locations": np.array(locations, dtype=object),
+        "categories": np.array(categories, dtype=object),
+        "vocab": np.array(vocab, dtype=object),
+        "tf": tf,
+        "doc_len": tf.sum(axis=1),
+        "idf": np.log(1 + (len(passages) - df + 0.5) / (df + 0.5)).astype(np.float32),
+    }
+    index_folder = os.path.dirname(index_file)
+    if index_folder and not os.path.exists(index_folder):
+        os.makedirs(index_folder)
+    np.savez(index_file, **{k: v.astype(str) if v.dtype == object else v for k, v in index.items()})
+    print(f"Built policy index: {len(passages)} passages, {len(vocab)} terms")
+    return index
+
+def is_index_stale(folder=POLICY_DOCS_FOLDER, index_file=POLICY_INDEX_FILE):
+    if not os.path.exists(index_file):
+        return True
+    built = os.path.getmtime(index_file)
+    for doc in list_policy_docs(folder):
+        sidecar = metadata_path(doc)
+        if os.path.getmtime(doc) > built or (sidecar.exists() and os.path.getmtime(sidecar) > built):
+            return True
+    return False
+
+def load_index(folder=POLICY_DOCS_FOLDER, index_file=POLICY_INDEX_FILE):
+    # Load the persisted index, rebuilding it when policy documents changed
+    if is_index_stale(folder, index_file):
+        return build_index(folder, index_file)
+    with np.load(index_file) as data:
+        index = {k: data[k] for k in data.files}
+    # Indexes built before categories were indexed
+    if "categories" not in index:
+        return build_index(folder, index_file)
+    return index
+
+def get_index():
+    # Long-running processes pick up edited policy documents within POLICY_INDEX_CHECK_SECONDS
+    global _index, _index_checked
+    with _index_lock:
+        now = time.monotonic()
+        if _index is not None and now - _index_checked >= POLICY_INDEX_CHECK_SECONDS:
+            _index_checked = now
+            if is_index_stale():
+                _index = None
+        if _index is None:
+            _index = load_index()
+            _index["term_ids"] = {t: i for i, t in enumerate(_index["vocab"])}
+            _index_checked = now
+        return _index
+
+def retrieve(query, top_k=3, categories=None):
+    # BM25 top-k policy passages, in the {text, s3_location} reference shape.
+    # categories restricts the search to passages of documents with one of those categories.
+    index = get_index()
+    if len(index["passages"]) == 0:
+        return []
+    ids = [index["term_ids"][t] for t in set(tokenize(query)) if t in index["term_ids"]]
+    if len(ids) == 0:
+        return []
+
+    tf = index["tf"][:, ids]
+    doc_len = index["doc_len"][:, None]
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / max(float(index["doc_len"].mean()), 1.0))
+    scores = (index["idf"][ids] * tf * (BM25_K1 + 1) / (tf + norm)).sum(axis=1)
+    if categories:
+        scores[~np.isin(index["categories"], categories)] = 0
+
+    top_k = min(top_k, len(scores))
+    top = np.argpartition(-scores, top_k - 1)[0:top_k]
+    top = top[np.argsort(-scores[top])]
+    return [
+        {"text": str(index["passages"][i]), "s3_location": str(index["locations"][i])}
+        for i in top if scores[i] > 0
+    ]
@@ -0,0 +1,242 @@
+import os
+import json
+import math
+import random
+from statistics import NormalDist
+from concurrent.futures import ThreadPoolExecutor
+
+from helper import lib
+
+# Audit mode estimates the violation rate of a large backlog from a stratified sample instead of
+# evaluating every row. A uniform reservoir of up to SAMPLING_POOL_SIZE rows is drawn in one pass,
+# pre-scored cheaply to assign strata, and rows are then evaluated in rounds allocated across strata
+# (Neyman allocation) until the confidence interval is narrower than the target or the budget runs out.
+SAMPLING_POOL_SIZE = int(os.environ.get('SAMPLING_POOL_SIZE', 20000))
+SAMPLING_TARGET_HALF_WIDTH = float(os.environ.get('SAMPLING_TARGET_HALF_WIDTH', 0.02))
+SAMPLING_CONFIDENCE = float(os.environ.get('SAMPLING_CONFIDENCE', 0.95))
+SAMPLING_MAX_EVALUATIONS = int(os.environ.get('SAMPLING_MAX_EVALUATIONS', 2000))
+SAMPLING_MAX_PARALLEL = int(os.environ.get('SAMPLING_MAX_PARALLEL', 8))
+# Rows evaluated per round between precision checks, and per stratum before the first check
+SAMPLING_ROUND_SIZE = 20
+SAMPLING_MIN_PER_STRATUM = 10
+# Upper bounds of the toxicity pre-score strata
+TOXICITY_STRATA = [0.1, 0.3, 0.6]
+STRATIFY_OPTIONS = ["toxicity", "language", "none"]
+# Comprehend toxicity detection accepts up to 1,000 bytes per segment; untranslated chunks can exceed it
+PRESCORE_TOXICITY_MAX_BYTES = 900
+
+def reservoir_sample(items, k=SAMPLING_POOL_SIZE, seed=None):
+    # Uniform sample of up to k items from a stream of unknown length in one pass; returns (sample, stream length)
+    rng = random.Random(seed)
+    sample = []
+    n = 0
+    for item in items:
+        n += 1
+        if len(sample) < k:
+            sample.append(item)
+        else:
+            j = rng.randrange(n)
+            if j < k:
+                sample[j] = item
+    return sample, n
+
+def toxicity_stratum(score):
+    if score is None:
+        return "toxicity unknown"
+    lower = 0
+    for upper in TOXICITY_STRATA:
+        if score < upper:
+            return f"toxicity {lower}-{upper}"
+        lower = upper
+    return f"toxicity >= {lower}"
+
+def text_strata_keys(texts, stratify_by="toxicity"):
+    # Cheap pre-score of every pooled row with batched Comprehend calls, no translation or LLM.
+    # detect_language_batch cuts rows to the language detection limit; toxicity chunks are cut here.
+    if stratify_by == "language":
+        return [code or "unknown" for code in lib.detect_language_batch(texts)]
+    if stratify_by == "toxicity":
+        # A long row is scored on its most toxic chunk
+        chunks, owners = [], []
+        for idx, txt in enumerate(texts):
+            for chunk in lib.chunk_text(txt):
+                chunk = lib.truncate_bytes(chunk.strip(), PRESCORE_TOXICITY_MAX_BYTES)
+                if len(chunk) > 0:
+                    chunks.append(chunk)
+                    owners.append(idx)
+        scores = [None] * len(texts)
+        for idx, result in zip(owners, lib.detect_toxicity_batch(chunks)):
+            score = result.get("toxicity")
+            if score is not None and (scores[idx] is None or scores[idx] < score):
+                scores[idx] = score
+        return [toxicity_stratum(score) for score in scores]
+    return ["all"] * len(texts)
+
+def z_score(confidence):
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+class StratifiedAudit:
+    # Sequential stratified estimate of a violation rate. strata maps a stratum name to its pooled items;
+    # each stratum is weighted by its share of the pool, which is a uniform sample of the population.
+    def __init__(self, strata, population_size=None, confidence=SAMPLING_CONFIDENCE, target_half_width=SAMPLING_TARGET_HALF_WIDTH, seed=None):
+        rng = random.Random(seed)
+        self.pending = {}
+        for name, items in strata.items():
+            items = list(items)
+            rng.shuffle(items)
+            self.pending[name] = items
+        self.sizes = {name: len(items) for name, items in self.pending.items()}
+        self.pool_size = sum(self.sizes.values())
+        self.population_size = population_size or self.pool_size
+        self.confidence = confidence
+        self.target_half_width = target_half_width
+        self.z = z_score(confidence)
+        self.evaluated = {name: 0 for name in self.pending}
+        self.violations = {name: 0 for name in self.pending}
+        self.results = []
+
+    def smoothed_rate(self, name):
+        # (y + 1) / (n + 2) keeps the variance of a stratum with no violations yet above zero
+        return (self.violations[name] + 1) / (self.evaluated[name] + 2)
+
+    def next_round(self, size=SAMPLING_ROUND_SIZE):
+        # Pilot every stratum first, then give each new draw to the stratum furthest below its Neyman
+        # share W_h * S_h, which minimises the variance of the stratified estimate for the sample size
+        picks = []
+        counts = dict(self.evaluated)
+        open_strata = [name for name, items in self.pending.items() if len(items) > 0]
+        if len(open_strata) == 0:
+            return picks
+        neyman = {name: self.sizes[name] * math.sqrt(self.smoothed_rate(name) * (1 - self.smoothed_rate(name))) for name in open_strata}
+        total_neyman = sum(neyman.values())
+        taken = {name: 0 for name in open_strata}
+        for _ in range(size):
+            candidates = [name for name in open_strata if taken[name] < len(self.pending[name])]
+            if len(candidates) == 0:
+                break
+            pilots = [name for name in candidates if counts[name] < SAMPLING_MIN_PER_STRATUM]
+            if pilots:
+                name = min(pilots, key=counts.get)
+            else:
+                total = sum(counts.values()) + 1
+                name = max(candidates, key=lambda s: neyman[s] / total_neyman * total - counts[s])
+            picks.append((name, self.pending[name][taken[name]]))
+            taken[name] += 1
+            counts[name] += 1
+        for name, n in taken.items():
+            del self.pending[name][0:n]
+        return picks
+
+    def record(self, name, item, violated, result=None):
+        self.evaluated[name] += 1
+        if violated:
+            self.violations[name] += 1
+        self.results.append((name, item, violated, result))
+
+    def estimate(self):
+        # The pool is a uniform sample of the population, so the interval covers two sources of error:
+        # sampling rows within each stratum of the pool, and the stratum weights estimated from the pool
+        rates, weights = {}, {}
+        rate, variance = 0.0, 0.0
+        strata = []
+        for name, size in self.sizes.items():
+            weights[name] = size / self.pool_size
+            n = self.evaluated[name]
+            rates[name] = self.violations[name] / n if n > 0 else self.smoothed_rate(name)
+            p_var = self.smoothed_rate(name) * (1 - self.smoothed_rate(name))
+            # Finite population correction against the stratum's share of the population
+            stratum_population = weights[name] * self.population_size
+            fpc = max(0.0, 1 - n / stratum_population) if stratum_population > 0 else 0
+            rate += weights[name] * rates[name]
+            variance += weights[name] ** 2 * p_var * fpc / max(n, 1)
+            strata.append({"stratum": name, "pool rows": size, "weight": round(weights[name], 4), "evaluated": n,
+                           "violations": self.violations[name], "violation rate": round(rates[name], 4)})
+        if self.pool_size < self.population_size:
+            # Two-phase sampling term for the weights; zero when the pool is the whole population
+            pool_fpc = 1 - self.pool_size / self.population_size
+            variance += pool_fpc / self.pool_size * sum(weights[name] * (rates[name] - rate) ** 2 for name in self.sizes)
+        half_width = self.z * math.sqrt(variance)
+        evaluations = sum(self.evaluated.values())
+        return {
+            "population": self.population_size,
+            "pool": self.pool_size,
+            "evaluations": evaluations,
+            "confidence": self.confidence,
+            "violation_rate": round(rate, 4),
+            "half_width": round(half_width, 4),
+            "lower": round(max(0.0, rate - half_width), 4),
+            "upper": round(min(1.0, rate + half_width), 4),
+            "estimated_violations": round(rate * self.population_size),
+            "strata": strata,
+        }
+
+    def piloted(self):
+        # Every stratum has had its pilot draws (rows that failed to evaluate count as drawn)
+        return all(size - len(self.pending[name]) >= min(SAMPLING_MIN_PER_STRATUM, size) for name, size in self.sizes.items())
+
+    def done(self):
+        if not self.piloted():
+            return False
+        return self.estimate()["half_width"] <= self.target_half_width
+
+def run_audit(audit, evaluate, max_evaluations=SAMPLING_MAX_EVALUATIONS, on_round=None):
+    # evaluate(item) -> (violated, result); violated is None when the item could not be evaluated.
+    # Rounds run concurrently and stop once the audit reaches its precision, the budget or the end of the pool.
+    with ThreadPoolExecutor(max_workers=SAMPLING_MAX_PARALLEL) as executor:
+        while not audit.done():
+            remaining = max_evaluations - sum(audit.evaluated.values()) if max_evaluations else SAMPLING_ROUND_SIZE
+            picks = audit.next_round(min(SAMPLING_ROUND_SIZE, remaining))
+            if len(picks) == 0:
+                break
+            for (name, item), (violated, result) in zip(picks, executor.map(lambda pick: evaluate(pick[1]), picks)):
+                if violated is not None:
+                    audit.record(name, item, violated, result)
+            if on_round:
+                on_round(audit)
+    return audit.estimate()
+
+def audit_text_rows(rows, prompt_template, threshold, enable_toxicity_dependency=True, stratify_by="toxicity",
+                    target_half_width=SAMPLING_TARGET_HALF_WIDTH, max_evaluations=SAMPLING_MAX_EVALUATIONS, on_round=None, seed=None):
+    # rows: iterator of (row number, message). Returns the audit, whose results hold the evaluated TextItems.
+    pool, population = reservoir_sample(((idx, txt.strip()) for idx, txt in rows if len(txt.strip()) > 0), seed=seed)
+    strata = {}
+    for row, key in zip(pool, text_strata_keys([txt for _, txt in pool], stratify_by)):
+        strata.setdefault(key, []).append(row)
+    audit = StratifiedAudit(strata, population, target_half_width=target_half_width, seed=seed)
+
+    def evaluate(row):
+        item = lib.evaluate_text(row[1], prompt_template, threshold, enable_toxicity_dependency)
+        if item.error is not None:
+            return None, item
+        return item.llm is not None and item.llm.answer == "Y", item
+
+    run_audit(audit, evaluate, max_evaluations, on_round)
+    return audit
+
+def audit_segments(transcriptions, prompt_template, target_half_width=SAMPLING_TARGET_HALF_WIDTH,
+                   max_evaluations=SAMPLING_MAX_EVALUATIONS, on_round=None, seed=None):
+    # Stratified by the toxicity score the transcriptions already carry, so pre-scoring is free.
+    # Returns per-segment LLM responses and statuses like lib.evaluate_segments, plus the audit.
+    strata = {}
+    for idx, tran in enumerate(transcriptions):
+        strata.setdefault(toxicity_stratum(tran.get("toxicity")), []).append(idx)
+    audit = StratifiedAudit(strata, target_half_width=target_half_width, seed=seed)
+
+    def evaluate(idx):
+        response = lib.call_bedrock_knowledge_base(transcriptions[idx]["text"], prompt_template, [transcriptions[idx].get("categories")])
+        return response.answer == "Y", response
+
+    run_audit(audit, evaluate, max_evaluations, on_round)
+    responses = [None] * len(transcriptions)
+    statuses = ["skipped_not_sampled"] * len(transcriptions)
+    for _, idx, _, response in audit.results:
+        responses[idx] = response
+        statuses[idx] = "evaluated_in_sample"
+    return responses, statuses, audit
+
+def save_estimate(estimate, file_path):
+    folder = os.path.dirname(file_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(file_path, "w") as json_file:
+        json.dump(estimate, json_file, indent=2)
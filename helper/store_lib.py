@@ -0,0 +1,137 @@
+import os
+import re
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from helper import result_lib
+
+STORE_FOLDER = os.environ.get('STORE_FOLDER', 'data/store/')
+TOXICITY_CATEGORIES = result_lib.TOXICITY_CATEGORIES
+VERDICT_CODES = {"Y": 1, "N": 0}
+VERDICT_NOT_EVALUATED = -1
+
+SCHEMA = pa.schema(
+    [
+        ("report", pa.string()),
+        ("source", pa.string()),
+        ("segment", pa.int32()),
+        ("evaluated_at", pa.float64()),
+        ("language", pa.string()),
+        ("toxicity_source", pa.string()),
+        ("text", pa.string()),
+        ("start_time", pa.float32()),
+        ("end_time", pa.float32()),
+        ("toxicity", pa.float32()),
+    ]
+    + [(c, pa.float32()) for c in TOXICITY_CATEGORIES]
+    + [("verdict", pa.int8())]
+)
+
+def new_columns():
+    return {name: [] for name in SCHEMA.names}
+
+def append_segment(columns, report, source, segment, evaluated_at, language, toxicity_source, toxicity, llm, text=None):
+    # toxicity and llm are result_lib.Toxicity and LlmResult; category scores are already in column order.
+    # text defaults to the scored text of the segment
+    columns["report"].append(report)
+    columns["source"].append(source)
+    columns["segment"].append(segment)
+    columns["evaluated_at"].append(evaluated_at)
+    columns["language"].append(language)
+    columns["toxicity_source"].append(toxicity_source)
+    if toxicity is None:
+        toxicity = result_lib.Toxicity(None)
+    columns["text"].append(toxicity.text if text is None else text)
+    columns["start_time"].append(np.nan if toxicity.start_time is None else toxicity.start_time)
+    columns["end_time"].append(np.nan if toxicity.end_time is None else toxicity.end_time)
+    columns["toxicity"].append(np.nan if toxicity.toxicity is None else toxicity.toxicity)
+    for c, score in zip(TOXICITY_CATEGORIES, toxicity.categories):
+        columns[c].append(score)
+    columns["verdict"].append(VERDICT_CODES.get(llm.answer, VERDICT_NOT_EVALUATED) if llm else VERDICT_NOT_EVALUATED)
+
+def audio_report_columns(result, report, language=None, evaluated_at=None):
+    evaluated_at = evaluated_at or time.time()
+    columns = new_columns()
+    for idx, segment in enumerate(result.segments):
+        append_segment(columns, report, "audio", idx, evaluated_at, language, result.toxicity_source,
+                       segment.transcription, segment.llm_response)
+    return columns
+
+def text_report_columns(result, report, evaluated_at=None):
+    evaluated_at = evaluated_at or time.time()
+    columns = new_columns()
+    for idx, item in enumerate(result.evaluations):
+        append_segment(columns, report, "text", idx, evaluated_at, item.raw_language_code, "comprehend",
+                       item.toxicity, item.llm, item.raw_text)
+    return columns
+
+def write_report(source, report, columns):
+    folder = os.path.join(STORE_FOLDER, source)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    # One file per report, so re-running a report replaces its rows
+    file_name = re.sub(r'[^A-Za-z0-9._-]', '_', report)
+    pq.write_table(pa.table(columns, schema=SCHEMA), os.path.join(folder, f'{file_name}.parquet'))
+
+def save_audio_report(result, report, language=None):
+    write_report("audio", report, audio_report_columns(result, report, language))
+
+def save_text_report(result, report):
+    write_report("text", report, text_report_columns(result, report))
+
+def load_segments(columns=None, source=None, since=None):
+    # Load stored segments as a dict of NumPy arrays, one per column
+    if not os.path.exists(STORE_FOLDER):
+        return {name: np.array([]) for name in (columns or SCHEMA.names)}
+
+    dataset = ds.dataset(STORE_FOLDER, format="parquet", schema=SCHEMA)
+    condition = None
+    if source is not None:
+        condition = pc.field("source") == source
+    if since is not None:
+        c = pc.field("evaluated_at") >= since
+        condition = c if condition is None else condition & c
+
+    table = dataset.to_table(columns=columns, filter=condition)
+    return {name: table.column(name).to_numpy() for name in table.column_names}
+
+def summarize_categories(segments, threshold):
+    # Vectorized per-category statistics over all loaded segments
+    names = ["toxicity"] + TOXICITY_CATEGORIES
+    scores = np.stack([segments[name].astype(np.float32) for name in names])
+    scored = ~np.isnan(scores)
+    with np.errstate(invalid="ignore"):
+        above = np.nansum(scores >= threshold, axis=1)
+    counts = scored.sum(axis=1)
+    has_scores = counts > 0
+    percentiles = np.full((3, len(names)), np.nan, dtype=np.float32)
+    if has_scores.any():
+        percentiles[:, has_scores] = np.nanpercentile(scores[has_scores], [50, 90, 99], axis=1)
+    return {
+        "category": names,
+        "segments": counts,
+        "mean": np.divide(np.nansum(scores, axis=1), counts, out=np.full(len(names), np.nan, dtype=np.float32), where=has_scores),
+        "p50": percentiles[0],
+        "p90": percentiles[1],
+        "p99": percentiles[2],
+        f"share >= {threshold}": np.divide(above, counts, out=np.zeros(len(names)), where=has_scores),
+    }
+
+def violation_rate_by(segments, key):
+    # Evaluated segments, violations and violation rate grouped by a string column
+    values = np.where(segments[key] == None, "unknown", segments[key]).astype(str)
+    groups, inverse = np.unique(values, return_inverse=True)
+    verdict = segments["verdict"]
+    evaluated = np.bincount(inverse, weights=verdict != VERDICT_NOT_EVALUATED, minlength=len(groups))
+    violations = np.bincount(inverse, weights=verdict == VERDICT_CODES["Y"], minlength=len(groups))
+    return {
+        key: groups,
+        "segments": np.bincount(inverse, minlength=len(groups)),
+        "evaluated": evaluated.astype(np.int64),
+        "violations": violations.astype(np.int64),
+        "violation rate": np.divide(violations, evaluated, out=np.zeros(len(groups)), where=evaluated > 0),
+    }
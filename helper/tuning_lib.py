@@ -0,0 +1,68 @@
+import numpy as np
+
+def to_truth(values):
+    # Map labels (Y/N, 1/0, true/false) to a boolean array; unknown labels become -1
+    truth = np.full(len(values), -1, dtype=np.int8)
+    for idx, v in enumerate(values):
+        v = str(v).strip().lower()
+        if v in ("y", "yes", "1", "true", "violation"):
+            truth[idx] = 1
+        elif v in ("n", "no", "0", "false", "safe"):
+            truth[idx] = 0
+    return truth
+
+def confusion(flagged, truth):
+    # flagged: (..., n) bool, truth: (n,) bool. Counts are taken along the last axis.
+    tp = np.count_nonzero(flagged & truth, axis=-1)
+    fp = np.count_nonzero(flagged & ~truth, axis=-1)
+    fn = np.count_nonzero(~flagged & truth, axis=-1)
+    precision = np.divide(tp, tp + fp, out=np.zeros(tp.shape), where=(tp + fp) > 0)
+    recall = np.divide(tp, tp + fn, out=np.zeros(tp.shape), where=(tp + fn) > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(tp.shape), where=(precision + recall) > 0)
+    return tp, fp, fn, precision, recall, f1
+
+def sweep_thresholds(scores, truth, thresholds):
+    # Evaluate every threshold at once: a segment reaches the LLM when its score >= threshold.
+    # scores: (n,) with NaN for unscored segments, truth: (n,) int8 with -1 for unknown.
+    scores = np.nan_to_num(np.asarray(scores, dtype=np.float32), nan=0.0)
+    thresholds = np.asarray(thresholds, dtype=np.float32)
+    flagged = scores[None, :] >= thresholds[:, None]
+    known = truth >= 0
+    tp, fp, fn, precision, recall, f1 = confusion(flagged[:, known], truth[known] == 1)
+    llm_calls = np.count_nonzero(flagged, axis=1)
+    return {
+        "threshold": thresholds,
+        "llm_calls": llm_calls,
+        "llm_calls_saved": len(scores) - llm_calls,
+        "true_positive": tp,
+        "false_positive": fp,
+        "false_negative": fn,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+    }
+
+def sweep_category_thresholds(category_scores, truth, thresholds):
+    # Sweep each category on its own. category_scores: (k, n). Returns (k, t) matrices.
+    category_scores = np.nan_to_num(np.asarray(category_scores, dtype=np.float32), nan=0.0)
+    thresholds = np.asarray(thresholds, dtype=np.float32)
+    known = truth >= 0
+    flagged = category_scores[:, None, known] >= thresholds[None, :, None]
+    tp, fp, fn, precision, recall, f1 = confusion(flagged, truth[known] == 1)
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+def evaluate_category_thresholds(category_scores, truth, category_thresholds):
+    # A segment reaches the LLM when any category score meets its own threshold
+    category_scores = np.nan_to_num(np.asarray(category_scores, dtype=np.float32), nan=0.0)
+    category_thresholds = np.asarray(category_thresholds, dtype=np.float32)
+    flagged = np.any(category_scores >= category_thresholds[:, None], axis=0)
+    known = truth >= 0
+    tp, fp, fn, precision, recall, f1 = confusion(flagged[known], truth[known] == 1)
+    llm_calls = int(np.count_nonzero(flagged))
+    return {
+        "llm_calls": llm_calls,
+        "llm_calls_saved": len(flagged) - llm_calls,
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1": float(f1),
+    }
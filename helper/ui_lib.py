@@ -1,5 +1,4 @@
 import os
-import json
 import streamlit as st
 from annotated_text import annotated_text
 from jinja2 import Template
@@ -7,11 +6,39 @@ import boto3
 import requests
 from io import BytesIO
 
-TRANSCRIBE_TOXICITY_THRESHOLD = 0.4
-COMPREHEND_TOXICITY_THRESHOLD = 0.6
+from helper import result_lib
+
+TRANSCRIBE_TOXICITY_THRESHOLD = float(os.environ.get('TRANSCRIBE_TOXICITY_THRESHOLD', 0.4))
+COMPREHEND_TOXICITY_THRESHOLD = float(os.environ.get('COMPREHEND_TOXICITY_THRESHOLD', 0.6))
+
+PRESIGNED_URL_EXPIRATION = 3600
+REPORT_LIST_TTL = 30
 
 s3 = boto3.client('s3')
 
+# Streamlit reruns the page script on every widget interaction; these cache what does not change between reruns
+
+# Cached URLs are refreshed well before they expire
+@st.cache_data(ttl=PRESIGNED_URL_EXPIRATION - 600, show_spinner=False)
+def get_presigned_url(bucket, key):
+    return s3.generate_presigned_url('get_object',
+                                     Params={'Bucket': bucket, 'Key': key},
+                                     ExpiresIn=PRESIGNED_URL_EXPIRATION)
+
+@st.cache_data(ttl=REPORT_LIST_TTL, show_spinner=False)
+def list_reports(folder):
+    if not os.path.exists(folder):
+        return ()
+    return tuple(sorted(file for file in os.listdir(folder) if os.path.isfile(os.path.join(folder, file))))
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _load_report(file_path, mtime):
+    return result_lib.load(file_path)
+
+def load_report(file_path):
+    # The modification time is part of the cache key, so rewritten reports are reloaded
+    return _load_report(file_path, os.path.getmtime(file_path))
+
 def get_toxicity_threshold(toxicity_source):
     if toxicity_source is not None:
         return COMPREHEND_TOXICITY_THRESHOLD if toxicity_source == "comprehend" else TRANSCRIBE_TOXICITY_THRESHOLD
@@ -23,94 +50,110 @@ def display_toxicity_analysis(toxicity_data):
 
     col1, col2 = st.columns(2)
 
-    if "toxicity" in toxicity_data:
+    if toxicity_data.toxicity is not None:
         col1.text("Toxicity Score:")
-        col1.caption(f'{toxicity_data["toxicity"]}')
+        col1.caption(f'{toxicity_data.toxicity}')
 
     col1.text("Message:")
-    col1.caption(f'{toxicity_data["text"]}')
+    col1.caption(f'{toxicity_data.text}')
 
-    if "categories" in toxicity_data:
+    categories = toxicity_data.category_scores()
+    if len(categories) > 0:
         col2.text("Toxicity analysis")
-        col2.bar_chart(toxicity_data["categories"])
+        col2.bar_chart(categories)
 
 def display_llm(response):
-    reference = response.get("references")
-
     st.subheader("Policy Evaluation")
     st.text(f'Violation:')
-    if response.get("answer") == "Y":
-        annotated_text((response["answer"], "violation", "#faa"))
-    elif response["answer"] is not None:
-        annotated_text((response["answer"], "safe", "#afa"))
+    if response.answer == "Y":
+        annotated_text((response.answer, "violation", "#faa"))
+    elif response.answer is not None:
+        annotated_text((response.answer, "safe", "#afa"))
 
-    if "analysis" in response and len(response["analysis"]) > 0:
+    analysis = response.analysis
+    if len(analysis) > 0:
         st.text("LLM Analysis:")
-        st.caption(f'{response["analysis"]}')
-
-    if reference is not None and len(reference) > 0:
-        st.table(reference)
+        st.caption(f'{analysis}')
+
+    if len(response.references) > 0:
+        st.table([{"text": r.text, "s3_location": r.s3_location} for r in response.references])
+
+def display_profile(profile):
+    st.subheader("Profiling")
+    st.caption(f'Run took {profile.elapsed:.2f} seconds. Profile: {profile.profile_path}, flame graph stacks: {profile.collapsed_path}')
+    st.dataframe(profile.hotspots, use_container_width=True)
+
+def display_audit(estimate):
+    st.subheader("Sampling audit")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Estimated violation rate", f'{estimate["violation_rate"]:.2%}',
+                help=f'{estimate["confidence"]:.0%} confidence interval: {estimate["lower"]:.2%} - {estimate["upper"]:.2%}')
+    col2.metric("Confidence interval half-width", f'±{estimate["half_width"]:.2%}')
+    col3.metric("Evaluated", f'{estimate["evaluations"]} of {estimate["population"]}')
+    st.caption(f'About {estimate["estimated_violations"]} violations expected in {estimate["population"]} rows, estimated from a stratified sample of a {estimate["pool"]}-row pool.')
+    st.dataframe(estimate["strata"], use_container_width=True)
 
 def plot_audio_eval_report(data, show_audio=True):
-    threshold = get_toxicity_threshold(data.get("toxicity_source"))
+    threshold = get_toxicity_threshold(data.toxicity_source)
 
-    if show_audio and "s3_path" in data:
-        s3_presigned_url = s3.generate_presigned_url('get_object',
-                                                        Params={'Bucket': data["s3_path"]["s3_bucket"],
-                                                                'Key':  data["s3_path"]["s3_key"]},
-                                                        ExpiresIn=3600)
+    if show_audio and data.s3_key is not None:
+        s3_presigned_url = get_presigned_url(data.s3_bucket, data.s3_key)
 
         st.audio(s3_presigned_url)
 
     # Plot UI
-    toxic_max = data.get("toxic_max")
+    toxic_max = data.toxic_max
     if toxic_max is not None and toxic_max >= threshold:
-        st.markdown(f'***Max toxicity score:*** :red[{data["toxic_max"]}]')
+        st.markdown(f'***Max toxicity score:*** :red[{toxic_max}]')
     else:
-        st.markdown(f'***Max toxicity score:*** :green[{data["toxic_max"]}]')
-    if data["violation"] == True:
-        st.markdown(f'***Violation:*** :red[{data["violation"]}]')
+        st.markdown(f'***Max toxicity score:*** :green[{toxic_max}]')
+    if data.violation == True:
+        st.markdown(f'***Violation:*** :red[{data.violation}]')
     else:
-        st.markdown(f'***Violation:*** :green[{data["violation"]}]')
+        st.markdown(f'***Violation:*** :green[{data.violation}]')
+    if data.llm_calls is not None:
+        st.markdown(f'***LLM calls:*** {data.llm_calls}')
 
     st.markdown('***Full transcription:***')
-    st.caption(data["full_transcription"])
-
-    strans = data.get('transcriptions')
-    if strans is not None:
-        for tran in strans:
-            llm = tran.get("llm_response")
-            title = f'{tran["transcription"]["text"]} - toxicity score: {tran["transcription"].get("toxicity")}, violation: { llm["answer"] if llm else None}'
-            if "start_time" in tran["transcription"] and "end_time"in tran["transcription"]:
-                title = f'[{tran["transcription"]["start_time"]} - {tran["transcription"]["end_time"]}] ' + title
-            violation = llm["answer"] if llm else None
-            toxicity_score = tran["transcription"].get("toxicity")
-            if llm is not None and llm["answer"] == "Y" and (toxicity_score is None or toxicity_score >= threshold):
-                title = f':heavy_exclamation_mark: :red[{title}]'
-            elif violation == "Y" or (toxicity_score is not None and toxicity_score >= threshold):
-                title = f':warning: :orange[{title}]'
-            with st.expander(title, expanded=False):
-                if "transcription" in tran and "toxicity" in tran["transcription"]:
-                    display_toxicity_analysis(tran["transcription"])
-                if llm is not None:
-                    display_llm(llm)
+    st.caption(data.full_transcription)
+
+    for segment in data.segments:
+        tran, llm = segment.transcription, segment.llm_response
+        violation = llm.answer if llm else None
+        toxicity_score = tran.toxicity
+        title = f'{tran.text} - toxicity score: {toxicity_score}, violation: {violation}'
+        if tran.start_time is not None and tran.end_time is not None:
+            title = f'[{tran.start_time} - {tran.end_time}] ' + title
+        if llm is None and (segment.llm_status or "").startswith("skipped"):
+            title += ' (not sampled)' if segment.llm_status == "skipped_not_sampled" else ' (not evaluated)'
+        elif segment.llm_status == "evaluated_in_window":
+            title += ' (evaluated with adjacent segments)'
+        if violation == "Y" and (toxicity_score is None or toxicity_score >= threshold):
+            title = f':heavy_exclamation_mark: :red[{title}]'
+        elif violation == "Y" or (toxicity_score is not None and toxicity_score >= threshold):
+            title = f':warning: :orange[{title}]'
+        with st.expander(title, expanded=False):
+            if toxicity_score is not None:
+                display_toxicity_analysis(tran)
+            if llm is not None:
+                display_llm(llm)
 
 def plot_text_eval_report(data):
-    threshold = get_toxicity_threshold(data.get("toxicity_source"))
+    threshold = COMPREHEND_TOXICITY_THRESHOLD
 
     # Plot UI
-    evaluations = data.get('evaluations')
-    if evaluations is not None:
-        for item in evaluations:
-            plot_text_eval_item(item)
+    for item in data.evaluations:
+        plot_text_eval_item(item, threshold)
 
-def plot_text_eval_item(item, threshold=0.6, index=None):
+def plot_text_eval_item(item, threshold=None, index=None):
     if item is None:
         return
+    if threshold is None:
+        threshold = COMPREHEND_TOXICITY_THRESHOLD
 
-    violation = item["llm"]["answer"] if "llm" in item and item["llm"] is not None else None
-    toxicity_score = item["toxicity"].get("toxicity")
-    title = f'{item["raw_text"]} - toxicity score: {toxicity_score}, violation: {violation}'
+    violation = item.llm.answer if item.llm is not None else None
+    toxicity_score = item.toxicity.toxicity if item.toxicity is not None else None
+    title = f'{item.raw_text} - toxicity score: {toxicity_score}, violation: {violation}'
 
     if violation == "Y" and (toxicity_score is None or toxicity_score >= threshold):
         title = f':heavy_exclamation_mark: :red[{title}]'
@@ -120,41 +163,41 @@ def plot_text_eval_item(item, threshold=0.6, index=None):
         title = f'{index} - {title}'
 
     with st.expander(title, expanded=False):
-        if "raw_language_code" in item:
-            st.text(f"Original language code: {item['raw_language_code']}")
-        if "translated_text" in item and item["translated_text"] is not None:
-            st.text("Translated text: " + item["translated_text"])
+        st.text(f"Original language code: {item.raw_language_code}")
+        if item.translated_text is not None:
+            st.text("Translated text: " + item.translated_text)
 
-        if "toxicity" in item and "toxicity" in item["toxicity"]:
-            display_toxicity_analysis(item["toxicity"])
-        if "llm" in item and item["llm"] is not None:
-            display_llm(item["llm"])
+        if toxicity_score is not None:
+            display_toxicity_analysis(item.toxicity)
+        if item.llm is not None:
+            display_llm(item.llm)
 
 def generate_video_eval_html(data, file_name):
-    threshold = get_toxicity_threshold(data.get("toxicity_source"))
+    threshold = get_toxicity_threshold(data.toxicity_source)
 
     segments = ""
     # Add extra fileds for UI display
-    trans = data["transcriptions"]
     idx = -1
-    for t in trans:
+    for segment in data.segments:
         idx += 1
+        tran, llm = segment.transcription, segment.llm_response
+        toxicity_score = tran.toxicity or 0
         image_class = "safe"
-        if t["transcription"]["toxicity"] >= threshold and (t["llm_response"] and t["llm_response"]["answer"] == "Y"):
+        if toxicity_score >= threshold and (llm and llm.answer == "Y"):
             image_class = "alert"
-        elif t["transcription"]["toxicity"] >= threshold or (t["llm_response"] and t["llm_response"]["answer"] == "Y"):
+        elif toxicity_score >= threshold or (llm and llm.answer == "Y"):
             image_class = "warn"
 
         cates, refs = "", ""
-        for key, value in t["transcription"]["categories"].items():
+        for key, value in tran.category_scores().items():
             cates += f"<li>{ key }: { value }</li>"
-        if t["llm_response"]:
-            for r in t["llm_response"]["references"]:
-                refs += f'<li>{ r["text"] } - <a href="{r["s3_location"] }">Link</a></li>'
+        if llm:
+            for r in llm.references:
+                refs += f'<li>{ r.text } - <a href="{r.s3_location }">Link</a></li>'
 
-        title = t["transcription"]["text"]
-        if "start_time" in t["transcription"] and "end_time" in t["transcription"]:
-            title = f'[{t["transcription"]["start_time"]} - {t["transcription"]["end_time"]}] ' + title
+        title = tran.text
+        if tran.start_time is not None and tran.end_time is not None:
+            title = f'[{tran.start_time} - {tran.end_time}] ' + title
 
         segments += f'''
             <div class="container">
@@ -165,14 +208,14 @@ def generate_video_eval_html(data, file_name):
                 <div id="content_{idx}" class="content">
                 <div>
                     <div>
-                        <h3>Toxicity score: {t["transcription"]["toxicity"] }</h3>
+                        <h3>Toxicity score: {tran.toxicity }</h3>
                         <h3>Toxicity categories</h3>
                         <ul>{cates}</ul>
                     </div>
                     <div>
                         <h3>LLM Response</h3>
-                        <p>Answer: { "" if t["llm_response"] is None else t["llm_response"]["answer"] }</p>
-                        <p>Analysis: {"" if t["llm_response"] is None else t["llm_response"]["analysis"] }</p>
+                        <p>Answer: { segment.llm_status or "" if llm is None else llm.answer }</p>
+                        <p>Analysis: {"" if llm is None else llm.analysis }</p>
                         <h3>References</h3>
                         <ul>{refs}</ul>
                     </div>
@@ -299,35 +342,38 @@ def generate_video_eval_html(data, file_name):
     # Create Jinja2 template object
     #template = Template(html_template)
     output_html = html_template.replace("##file_name##", file_name)
-    output_html = output_html.replace("##toxicity_max##", str(data["toxic_max"]))
-    output_html = output_html.replace("##violation##", str(data["violation"]))
-    output_html = output_html.replace("##full_transcription##", data.get("full_transcription"))
-    output_html = output_html.replace("##toxicity_source##", data["toxicity_source"])
+    output_html = output_html.replace("##toxicity_max##", str(data.toxic_max))
+    output_html = output_html.replace("##violation##", str(data.violation))
+    output_html = output_html.replace("##full_transcription##", data.full_transcription)
+    output_html = output_html.replace("##toxicity_source##", data.toxicity_source)
     output_html = output_html.replace("##segments##", segments)
 
     return output_html
 
-def generate_text_eval_html(data, file_name, threshold=0.6):
+def generate_text_eval_html(data, file_name, threshold=None):
+    if threshold is None:
+        threshold = COMPREHEND_TOXICITY_THRESHOLD
     segments = ""
     # Add extra fields for UI display
-    trans = data["evaluations"]
     idx = -1
-    for t in trans:
+    for t in data.evaluations:
         idx += 1
+        toxicity = t.toxicity or result_lib.Toxicity(t.raw_text)
+        toxicity_score = toxicity.toxicity or 0
         image_class = "safe"
-        if t["toxicity"]["toxicity"] >= threshold and (t["llm"] and t["llm"]["answer"] == "Y"):
+        if toxicity_score >= threshold and (t.llm and t.llm.answer == "Y"):
             image_class = "alert"
-        elif t["toxicity"]["toxicity"] >= threshold or (t["llm"] and t["llm"]["answer"] == "Y"):
+        elif toxicity_score >= threshold or (t.llm and t.llm.answer == "Y"):
             image_class = "warn"
 
         cates, refs = "", ""
-        for key, value in t["toxicity"]["categories"].items():
+        for key, value in toxicity.category_scores().items():
             cates += f"<li>{ key }: { value }</li>"
-        if t["llm"]:
-            for r in t["llm"]["references"]:
-                refs += f'<li>{ r["text"] } - <a href="{r["s3_location"] }">Link</a></li>'
+        if t.llm:
+            for r in t.llm.references:
+                refs += f'<li>{ r.text } - <a href="{r.s3_location }">Link</a></li>'
 
-        title = t["raw_text"]
+        title = t.raw_text
 
         segments += f'''
             <div class="container">
@@ -338,14 +384,14 @@ def generate_text_eval_html(data, file_name, threshold=0.6):
                 <div id="content_{idx}" class="content">
                 <div>
                     <div>
-                        <h3>Toxicity score: {t["toxicity"]["toxicity"] }</h3>
+                        <h3>Toxicity score: {toxicity.toxicity }</h3>
                         <h3>Toxicity categories</h3>
                         <ul>{cates}</ul>
                     </div>
                     <div>
                         <h3>LLM Response</h3>
-                        <p>Answer: { "" if t["llm"] is None else t["llm"]["answer"] }</p>
-                        <p>Analysis: {"" if t["llm"] is None else t["llm"]["analysis"] }</p>
+                        <p>Answer: { "" if t.llm is None else t.llm.answer }</p>
+                        <p>Analysis: {"" if t.llm is None else t.llm.analysis }</p>
                         <h3>References</h3>
                         <ul>{refs}</ul>
                     </div>
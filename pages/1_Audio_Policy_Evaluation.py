@@ -1,5 +1,4 @@
 import streamlit as st 
-import json
 from io import BytesIO
 import os
 from pathlib import Path
@@ -9,6 +8,11 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 from helper import lib
 from helper import ui_lib as lib_ui
 from helper import constants
+from helper import cache_lib
+from helper import store_lib
+from helper import result_lib
+from helper import profile_lib
+from helper import sampling_lib
 
 SAMPLE_DATA_FOLDER = "data/audio_eval/"
 
@@ -27,7 +31,8 @@ audio_eval_tab, audio_sample_tab, doc_tab = st.tabs(["Audio Policy Evalution", "
 with doc_tab:
     st.image("static/audio-moderation.png", caption="Workflow diagram")
 
-with audio_eval_tab:
+@st.fragment
+def audio_evaluation_form():
     st.subheader("Upload a audio to start policy evaluation")
     
     uploaded_audio = st.file_uploader(key="uploaded_audio", label="Select an video or audio file", type=['mp4', 'mp3', "wav"])
@@ -42,134 +47,185 @@ with audio_eval_tab:
                 value=constants.TEXT_EVAL_PROMPTS_TEMPLATE,
                 height=200)
         enable_toxicity_dependency = st.toggle(label="Apply LLMs analysis only when toxicity detection returns a toxicity score exceeding the threshold", value=True)
+        riskiest_first = st.toggle(label="Evaluate segments with the highest toxicity score first", value=False)
+        stop_on_violation = st.toggle(label="Stop LLMs analysis once a violation is confirmed", value=False)
+        max_llm_calls = st.number_input(label="Maximum LLMs calls per file (0 for unlimited)", min_value=0, value=lib.LLM_MAX_CALLS_PER_FILE, step=1)
+        audit_mode = st.toggle(label="Audit mode: estimate the share of violating segments from a sample stratified by toxicity score", value=False)
+        target_half_width = sampling_lib.SAMPLING_TARGET_HALF_WIDTH
+        if audit_mode:
+            target_half_width = st.number_input("Target confidence interval half-width", min_value=0.001, max_value=0.5, value=target_half_width, step=0.005, format="%.3f")
 
         # Start Policy Evaluation
         st.session_state["detect_language"] = False
         if st.toggle("Detect language (If audio is in English, leave it unchecked to enable Transcribe's built-in toxicity analysis.)"):
             st.session_state['detect_language'] = True
+        enable_profiling = st.toggle(label="Profile this evaluation run", value=profile_lib.PROFILE_EVALUATION)
+        split_audio = st.toggle(f"Split long WAV audio at silence into segments of up to {lib.TRANSCRIBE_SEGMENT_SECONDS} seconds and transcribe them in parallel")
+        trim_silence = st.toggle("Cut silence out of WAV audio before transcription (segment times still refer to the original audio)")
 
         # Upload audio file to S3
         if st.button("Start policy evaluation"):
-            st.session_state['audio_eval_result'] = {}
-            with st.spinner("Uploading to S3... Please wait."):
-                s3_bucket, s3_key = lib.upload_to_s3(uploaded_audio)
-                st.session_state['s3_bucket'] = s3_bucket
-                st.session_state['s3_key'] = s3_key
+            profile_prefix = f"{SAMPLE_DATA_FOLDER}profiles/{uploaded_audio.name}"
+            with profile_lib.profile_run(profile_prefix, enable_profiling) as profile:
+                st.session_state['audio_eval_result'] = {}
                 st.session_state['toxicity_source'] = "comprehend"
-                st.info(f"Audio file uploaded successfully to S3: s3://{s3_bucket}/{s3_key}")
-
-            # Start evaluation
-            with st.spinner("Analyzing audio. This will take a few minutes to complete."):
-                # Transcribe audio
-                original, transcriptions = lib.transcribe_audio(st.session_state['s3_bucket'], st.session_state['s3_key'], st.session_state['detect_language'])
-                full_trans, display_trans, traslated_text = "", "", ""
-                for t in original["results"]["transcripts"]:
-                    full_trans += t["transcript"]
-                display_trans = full_trans
-                traslated_text = full_trans
-                st.session_state['toxicity_source'] = "comprehend" if "toxicity_detection" not in original else "transcribe"
-
-                # Translate transcription if not in english
-                if "language_code" in original["results"]:
-                    language_code = original["results"]["language_code"][0:2]
-                    if language_code != "en":
-                        traslated_text = lib.translate_text(full_trans,language_code)
-                        if traslated_text is None:
-                            st.warning(f'Unsupported language detected in the audio: {full_trans,original["results"]["language_code"]}',icon="⚠️")
-                            st.text(full_trans)
-                            st.stop()
-                        display_trans = f'Orginial ({language_code}): {full_trans}  \nTranslation: {traslated_text}'
-
-                    transcriptions = []
-                    ts = lib.chunk_text(traslated_text)
-                    for t in ts:
-                        transcriptions.append(
-                            lib.detect_toxicity(t)
-                        )
-
-
-                result = {"transcriptions" : [], "full_transcription": display_trans}
-
-                st.info("Performed audio transcription with toxicity analysis using amazon transcribe")
-                st.markdown(f'***Transcription:*** {display_trans}')
-                st.info("Evaluating policy using Amazon Bedrock Knowledge Base")
-                if transcriptions is None or len(transcriptions) == 0:
-                    st.warning('No transcription')
+                # Read the audio once up front: upload_fileobj closes the uploaded file when it is done
+                audio_bytes = uploaded_audio.getvalue()
+                audio_hash = cache_lib.content_hash(audio_bytes)
+                cached = lib.get_cached_transcription(audio_hash, st.session_state['detect_language'], trim_silence=trim_silence)
+                if cached is not None:
+                    st.session_state['s3_bucket'] = cached["s3_bucket"]
+                    st.session_state['s3_key'] = cached["s3_key"]
+                    st.info(f"Reusing the cached transcription of identical audio: s3://{cached['s3_bucket']}/{cached['s3_key']}")
                 else:
-                    # LLM evaluation for each segments
-                    st.subheader("Transcriptions and policy evaluation")
-                    toxic_max, violation = 0, False
-                    for tran in transcriptions:
-                        if "toxicity" in tran and tran["toxicity"] >= toxic_max:
-                            toxic_max = tran["toxicity"]
-
-                        response = None
-                        if not enable_toxicity_dependency or tran["toxicity"] > lib_ui.get_toxicity_threshold(st.session_state['toxicity_source']):
-                            response = lib.call_bedrock_knowledge_base(tran["text"], prompt_template)
-                            if response["answer"] == "Y":
-                                violation = True
+                    with st.spinner("Uploading to S3... Please wait."):
+                        s3_bucket, s3_key = lib.upload_to_s3(uploaded_audio)
+                        st.session_state['s3_bucket'] = s3_bucket
+                        st.session_state['s3_key'] = s3_key
+                        st.info(f"Audio file uploaded successfully to S3: s3://{s3_bucket}/{s3_key}")
+
+                # Start evaluation
+                with st.spinner("Analyzing audio. This will take a few minutes to complete."):
+                    # Transcribe audio
+                    if cached is not None:
+                        original = cached["original"]
+                        transcriptions = lib.parse_transcriptions(original)
+                    else:
+                        if trim_silence:
+                            original, transcriptions = lib.transcribe_audio_trimmed(st.session_state['s3_bucket'], st.session_state['s3_key'], audio_bytes, st.session_state['detect_language'], split_audio=split_audio)
+                        elif split_audio:
+                            original, transcriptions = lib.transcribe_audio_split(st.session_state['s3_bucket'], st.session_state['s3_key'], audio_bytes, st.session_state['detect_language'])
                         else:
-                            violation = None
-
-                        # Store result to session
-                        result["transcriptions"].append(
-                            {
-                                "llm_response": response,
-                                "transcription": tran
-                            }
-                        )
-
-                    result["toxic_max"] = toxic_max
-                    result["violation"] = violation
-                    result["toxicity_source"] = st.session_state['toxicity_source']
-                    result["s3_path"] = {
-                        "s3_bucket": st.session_state['s3_bucket'],
-                        "s3_key": st.session_state['s3_key']
-                    }
-                    st.session_state['audio_eval_result'] = result
-
-                    # store to file
-                    json_data = json.dumps(result, ensure_ascii=False)  # Optional: indent for pretty formatting
-                    if not os.path.exists(SAMPLE_DATA_FOLDER):
-                        os.makedirs(SAMPLE_DATA_FOLDER)
-                    file_path = f"{SAMPLE_DATA_FOLDER}{st.session_state['s3_key'].split('/')[-1]}.json"
-                    with open(file_path, "w") as json_file:
-                        json_file.write(json_data)
-
-            # Plot report
-            lib_ui.plot_audio_eval_report(st.session_state['audio_eval_result'], False)
-
-with audio_sample_tab:
-    st.subheader("Sample policy evaluation report")
-
-    if os.path.exists(SAMPLE_DATA_FOLDER):
-        option = st.selectbox("Select a sample audio",
-            tuple(file for file in os.listdir(SAMPLE_DATA_FOLDER) if os.path.isfile(os.path.join(SAMPLE_DATA_FOLDER, file)))
-        )
+                            original, transcriptions = lib.transcribe_audio(st.session_state['s3_bucket'], st.session_state['s3_key'], st.session_state['detect_language'])
+                        lib.put_cached_transcription(audio_hash, original, st.session_state['s3_bucket'], st.session_state['s3_key'], st.session_state['detect_language'], trim_silence=trim_silence)
+                    full_trans, display_trans, traslated_text = "", "", ""
+                    for t in original["results"]["transcripts"]:
+                        full_trans += t["transcript"]
+                    display_trans = full_trans
+                    traslated_text = full_trans
+                    st.session_state['toxicity_source'] = "comprehend" if "toxicity_detection" not in original else "transcribe"
+
+                    # Translate transcription if not in english
+                    if "language_code" in original["results"]:
+                        language_code = original["results"]["language_code"][0:2]
+                        pieces = [full_trans]
+                        if language_code != "en":
+                            if language_code not in lib.SUPPORTED_LANGUAGE:
+                                st.warning(f'Unsupported language detected in the audio: {full_trans,original["results"]["language_code"]}',icon="⚠️")
+                                st.text(full_trans)
+                                st.stop()
+                            # Long transcripts are translated in concurrent pieces under the request size limit
+                            pieces = lib.iter_translate_text(full_trans, language_code)
+
+                        # Run toxicity detection on each translated piece as soon as it arrives
+                        transcriptions, translated_pieces = [], []
+                        for piece in pieces:
+                            translated_pieces.append(piece)
+                            ts = lib.chunk_text(piece)
+                            for t in ts:
+                                transcriptions.append(
+                                    lib.detect_toxicity(t)
+                                )
+                        traslated_text = " ".join(translated_pieces)
+                        if language_code != "en":
+                            display_trans = f'Orginial ({language_code}): {full_trans}  \nTranslation: {traslated_text}'
+
+
+                    result = result_lib.AudioReport(display_trans)
+
+                    st.info("Performed audio transcription with toxicity analysis using amazon transcribe")
+                    st.markdown(f'***Transcription:*** {display_trans}')
+                    st.info("Evaluating policy using Amazon Bedrock Knowledge Base")
+                    if transcriptions is None or len(transcriptions) == 0:
+                        st.warning('No transcription')
+                    else:
+                        # LLM evaluation for each segments
+                        st.subheader("Transcriptions and policy evaluation")
+                        toxic_max = 0
+                        for tran in transcriptions:
+                            if "toxicity" in tran and tran["toxicity"] >= toxic_max:
+                                toxic_max = tran["toxicity"]
+
+                        if audit_mode:
+                            responses, statuses, audit = sampling_lib.audit_segments(transcriptions, prompt_template, target_half_width, max_llm_calls)
+                            estimate = audit.estimate()
+                            lib_ui.display_audit(estimate)
+                            sampling_lib.save_estimate(estimate, f"{SAMPLE_DATA_FOLDER}audits/{uploaded_audio.name.split('/')[-1]}.json")
+                            violation = any(r[2] for r in audit.results) if audit.results else None
+                            llm_calls = estimate["evaluations"]
+                        else:
+                            responses, statuses, violation, llm_calls = lib.evaluate_segments(
+                                transcriptions,
+                                prompt_template,
+                                lib_ui.get_toxicity_threshold(st.session_state['toxicity_source']),
+                                enable_toxicity_dependency=enable_toxicity_dependency,
+                                riskiest_first=riskiest_first,
+                                stop_on_violation=stop_on_violation,
+                                max_llm_calls=max_llm_calls
+                            )
+                        for tran, response, status in zip(transcriptions, responses, statuses):
+                            # Store result to session
+                            result.segments.append(result_lib.Segment(result_lib.Toxicity.from_dict(tran), response, status))
+
+                        result.toxic_max = toxic_max
+                        result.violation = violation
+                        result.llm_calls = llm_calls
+                        result.toxicity_source = st.session_state['toxicity_source']
+                        result.s3_bucket = st.session_state['s3_bucket']
+                        result.s3_key = st.session_state['s3_key']
+                        st.session_state['audio_eval_result'] = result
+
+                        # store to file
+                        if not os.path.exists(SAMPLE_DATA_FOLDER):
+                            os.makedirs(SAMPLE_DATA_FOLDER)
+                        # Named after this upload: on a cache hit s3_key is the earlier upload of the same audio, kept for playback
+                        file_path = f"{SAMPLE_DATA_FOLDER}{uploaded_audio.name.split('/')[-1]}.json"
+                        result_lib.save(result, file_path)
+                        store_lib.save_audio_report(result, file_path.split('/')[-1], original["results"].get("language_code", "en-US"))
+                        lib_ui.list_reports.clear()
+
+                # Plot report
+                lib_ui.plot_audio_eval_report(st.session_state['audio_eval_result'], False)
+            if profile is not None:
+                lib_ui.display_profile(profile)
+
+@st.fragment
+def sample_report_view():
+    reports = lib_ui.list_reports(SAMPLE_DATA_FOLDER)
+    if len(reports) > 0:
+        option = st.selectbox("Select a sample audio", reports)
         if option and len(option) > 0:
             # Plot UI
             file_path = f"{SAMPLE_DATA_FOLDER}{option}"
+            if not os.path.exists(file_path):
+                lib_ui.list_reports.clear()
+                st.warning(f"Sample file not found: {option}")
+                return
+
+            data = lib_ui.load_report(file_path)
+            lib_ui.plot_audio_eval_report(data)
+
+            # Export HTML report
+            if st.button("Export report in HTML"):
+                html = lib_ui.generate_video_eval_html(data, option)
+
+                if html:
+                    buffer = BytesIO()
+                    buffer.write(html.encode())
+                    buffer.seek(0)
+                    # Create a link to download the file
+                    st.download_button(label="Download File", data=buffer, file_name=f'{option}.html', key="download_button")
+
+            # Delete sample file
+            if st.button("Delete sample file"):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    lib_ui.list_reports.clear()
+                    st.text(f"Sample file deleted: {option}")
 
-            data = None
-            # Open and read the JSON file
-            with open(file_path, "r") as json_file:
-                data = json.load(json_file)
-                lib_ui.plot_audio_eval_report(data)
-
-                # Export HTML report
-                if st.button("Export report in HTML"):
-                    html = lib_ui.generate_video_eval_html(data, option)
-
-                    if html:
-                        buffer = BytesIO()
-                        buffer.write(html.encode())
-                        buffer.seek(0)
-                        # Create a link to download the file
-                        st.download_button(label="Download File", data=buffer, file_name=f'{option}.html', key="download_button")
-
-                # Delete sample file
-                if st.button("Delete sample file"):
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        st.text(f"Sample file deleted: {option}")
+with audio_eval_tab:
+    audio_evaluation_form()
 
+with audio_sample_tab:
+    st.subheader("Sample policy evaluation report")
+    sample_report_view()
@@ -1,7 +1,7 @@
 import streamlit as st 
-import json
 from io import BytesIO
 import os
+import itertools
 from pathlib import Path
 import sys
 sys.path.append(str(Path(__file__).resolve().parent.parent))
@@ -10,8 +10,14 @@ from streamlit.components.v1 import html
 from helper import lib
 from helper import ui_lib as lib_ui
 from helper import constants
+from helper import store_lib
+from helper import result_lib
+from helper import checkpoint_lib
+from helper import profile_lib
+from helper import sampling_lib
 
 SAMPLE_DATA_FOLDER = "data/text_eval/"
+PREVIEW_ROWS = 20
 
 pool_id = os.environ.get("COGNITIO_POOL_ID")
 app_client_id = os.environ.get("COGNITIO_APP_CLIENT_ID")
@@ -28,8 +34,10 @@ text_eval_tab, text_eval_bulk_tab, sample_tab, doc_tab = st.tabs(["Text Policy E
 with doc_tab:
     st.image("static/text-moderation.png", caption="Workflow diagram")
 
-def evaluate(text_content, key):
-    if text_content is None or len(text_content) == 0:
+@st.fragment
+def evaluate(rows, key, raw_content, file_name=None):
+    # rows: callable returning an iterator of (row number, message), so large files are streamed
+    if raw_content is None or len(raw_content) == 0:
         st.warning("Submit a message or upload a file to initiate the evaluation.")
     else:
         prompt_template = constants.TEXT_EVAL_PROMPTS_TEMPLATE
@@ -40,153 +48,172 @@ def evaluate(text_content, key):
                 value=constants.TEXT_EVAL_PROMPTS_TEMPLATE,
                 height=200)
 
-        result = {
-            "raw_content": text_content,
-            "evaluations": []
-        }
+        result = result_lib.TextReport(raw_content)
         enable_toxicity_dependency = st.toggle(key=f"{key}_toggle",label="Apply LLMs analysis only when toxicity detection returns a toxicity score exceeding the threshold", value=True)
 
+        enable_profiling = st.toggle(key=f"{key}_profile", label="Profile this evaluation run", value=profile_lib.PROFILE_EVALUATION)
+        resume, audit_mode = False, False
+        if file_name:
+            audit_mode = st.toggle(key=f"{key}_audit", label="Audit mode: estimate the violation rate from a stratified sample instead of evaluating every row", value=False)
+            if audit_mode:
+                col1, col2, col3 = st.columns(3)
+                stratify_by = col1.selectbox("Stratify by", sampling_lib.STRATIFY_OPTIONS, key=f"{key}_stratify")
+                target_half_width = col2.number_input("Target confidence interval half-width", min_value=0.001, max_value=0.5, value=sampling_lib.SAMPLING_TARGET_HALF_WIDTH, step=0.005, format="%.3f", key=f"{key}_half_width")
+                max_evaluations = col3.number_input("Maximum evaluations (0 for unlimited)", min_value=0, value=sampling_lib.SAMPLING_MAX_EVALUATIONS, step=100, key=f"{key}_max_evaluations")
+            else:
+                resume = st.toggle(key=f"{key}_resume", label="Resume from the rows already evaluated in a previous run of this file", value=True)
+
         # Start Policy Evaluation
-        # Upload file to S3
         if st.button(key=f"{key}_start", label="Start policy evaluation"):
-            # Start evaluation
-            rows = text_content.split('\n')
-            with st.spinner(f"Analyzing text messages. Total: {len(rows)}"):
-                idx = 0
-                for txt in rows:
-                    idx += 1
-                    txt = txt.strip()
-                    if len(txt) == 0:
-                        continue
-
-                    txt_en = txt
-                    item = {
-                        "raw_text": txt,
-                        "translated_text": None,
-                        "raw_language_code": None,
-                        "toxicity": None,
-                        "llm": None
-                    }
-
-                    # Detect language
-                    lang_code = lib.detect_language(txt)
-                    item["raw_language_code"] = lang_code
-                    lcode = lang_code[0:2].lower()
-
-                    # Translate to English
-                    if not lcode.startswith('en'):
-                        translated_text = lib.translate_text(txt,lcode)
-                        item["translated_text"] = translated_text
-                        if translated_text is None:
-                            st.warning(f'Unsupported language detected: {lang_code}',icon="⚠️")
-                            st.text(txt)
-                            st.stop()
-                        txt_en = translated_text
-                        item["translated_text"] = translated_text
-
-                    chunks = lib.chunk_text(txt_en)
-                    for chunk in chunks:
-                        chunk = chunk.strip()
-                        if len(chunk) == 0:
-                            continue
-                        # Comprehend Toxicity Analysis
-                        c_result = lib.detect_toxicity(chunk)
-                        if item["toxicity"] is None:
-                            item["toxicity"] = c_result
-                        elif item["toxicity"]["toxicity"] < c_result["toxicity"]:
-                            item["toxicity"] = c_result
-
-                        # Toxicity dependency enabled: only run LLMs when toxicity score greater than threshold
-                        if not enable_toxicity_dependency or c_result["toxicity"] >= lib_ui.COMPREHEND_TOXICITY_THRESHOLD:
-                            # LLM evaluation
-                            response = lib.call_bedrock_knowledge_base(chunk, prompt_template)
-                            violation = False
-                            if response["answer"] == "Y":
-                                violation = True
-
-                            if item["llm"] is None:
-                                item["llm"] = response
+            profile_prefix = f"{SAMPLE_DATA_FOLDER}profiles/{(file_name or key).split('/')[-1]}"
+            if audit_mode:
+                with profile_lib.profile_run(profile_prefix, enable_profiling) as profile:
+                    progress = st.empty()
+                    def show_progress(audit):
+                        estimate = audit.estimate()
+                        progress.caption(f'{estimate["evaluations"]} rows evaluated, violation rate {estimate["violation_rate"]:.2%} ± {estimate["half_width"]:.2%}')
+
+                    with st.spinner("Sampling and analyzing text messages..."):
+                        audit = sampling_lib.audit_text_rows(rows(), prompt_template, lib_ui.COMPREHEND_TOXICITY_THRESHOLD, enable_toxicity_dependency,
+                                                             stratify_by, target_half_width, max_evaluations, show_progress)
+                    estimate = audit.estimate()
+                    lib_ui.display_audit(estimate)
+                    sampling_lib.save_estimate(estimate, f"{SAMPLE_DATA_FOLDER}audits/{file_name.split('/')[-1]}.json")
+                    st.subheader("Sampled rows")
+                    for _, (idx, _), _, item in sorted(audit.results, key=lambda r: r[1][0]):
+                        lib_ui.plot_text_eval_item(item=item, index=idx)
+                if profile is not None:
+                    lib_ui.display_profile(profile)
+                return
+
+            with profile_lib.profile_run(profile_prefix, enable_profiling) as profile:
+                # Bulk runs append each row to a checkpoint log so an interrupted run can be resumed
+                log_path, log_file, done, seen = None, None, {}, {}
+                if file_name:
+                    log_path = checkpoint_lib.checkpoint_path(file_name, prompt_template, enable_toxicity_dependency)
+                    done = checkpoint_lib.load_checkpoint(log_path) if resume else {}
+                    log_file = checkpoint_lib.open_checkpoint(log_path, resume)
+                    if len(done) > 0:
+                        st.info(f"Resuming: {len(done)} rows were already evaluated in a previous run and will be skipped.")
+
+                # Start evaluation
+                try:
+                    with st.spinner("Analyzing text messages..."):
+                        for idx, txt in rows():
+                            txt = txt.strip()
+                            if len(txt) == 0:
+                                continue
+                            txt_hash = checkpoint_lib.row_hash(txt)
+                            seen[idx] = txt_hash
+                            if done.get(idx) == txt_hash:
+                                continue
+
+                            item = lib.evaluate_text(txt, prompt_template, lib_ui.COMPREHEND_TOXICITY_THRESHOLD, enable_toxicity_dependency)
+                            if item.error is not None:
+                                st.warning(item.error,icon="⚠️")
+                                st.text(txt)
+                                st.stop()
+
+                            lib_ui.plot_text_eval_item(item=item, index=idx)
+
+                            if log_file:
+                                checkpoint_lib.append_checkpoint(log_file, idx, txt_hash, item)
                             else:
-                                if response["answer"] == "Y":
-                                    item["llm"]["answer"] = "Y"
-                                item["llm"]["analysis"]  += response["analysis"]
-                                item["llm"]["references"] = item["llm"]["references"] + response["references"]
-
-                    lib_ui.plot_text_eval_item(item=item, index=idx)
-
-                    result["evaluations"].append(item)
-
-            # store to file
-            if uploaded_file:
-                print("store result to disk")
-                json_data = json.dumps(result, ensure_ascii=False) 
-                file_path = f"{SAMPLE_DATA_FOLDER}{uploaded_file.name.split('/')[-1]}.json"
-                if not os.path.exists(SAMPLE_DATA_FOLDER):
-                    os.makedirs(SAMPLE_DATA_FOLDER)
-                with open(file_path, "w") as json_file:
-                    json_file.write(json_data)
+                                result.evaluations.append(item)
+                finally:
+                    if log_file:
+                        log_file.close()
+
+                # store to file
+                if file_name:
+                    print("store result to disk")
+                    result.evaluations = checkpoint_lib.load_evaluations(log_path, seen)
+                    file_path = f"{SAMPLE_DATA_FOLDER}{file_name.split('/')[-1]}.json"
+                    if not os.path.exists(SAMPLE_DATA_FOLDER):
+                        os.makedirs(SAMPLE_DATA_FOLDER)
+                    result_lib.save(result, file_path)
+                    store_lib.save_text_report(result, file_path.split('/')[-1])
+                    lib_ui.list_reports.clear()
+            if profile is not None:
+                lib_ui.display_profile(profile)
 
 
 with text_eval_bulk_tab:
     st.subheader("Upload a audio to start policy evaluation")
-    text_content = None
-    st.caption("You can submit a TXT or CSV file containing multiple messages in separate rows without a header row. If the CSV file has multiple columns, this app will only consider the content from the first column.")
+    st.caption("You can submit a TXT file with one message per row, or a CSV file and choose the column containing the messages.")
     st.caption("This app is designed for demo and evaluate sample messages. To prevent UI timeouts, do not upload files containing more than 200 rows.")
     uploaded_file = st.file_uploader(key="uploaded_file", label="Select a file", type=['txt', 'csv'])
     if uploaded_file:
-        text_content = uploaded_file.read().decode("utf-8")
-        if text_content:
-            html(text_content.replace("\n","<br/>"), height=200, scrolling=True)
+        file_type = "csv" if uploaded_file.name.lower().endswith(".csv") else "txt"
+        column, skip_header = 0, False
+        if file_type == "csv":
+            header = lib.read_csv_header(uploaded_file)
+            skip_header = st.checkbox("The first row is a header row", value=False)
+            labels = header if skip_header else [f"Column {i + 1}" for i in range(len(header))]
+            if len(labels) > 1:
+                column = st.selectbox("Message column", range(len(labels)), format_func=lambda i: labels[i])
+
+        def rows():
+            return lib.iter_text_rows(uploaded_file, file_type, column, skip_header)
+
+        # Preview only the first rows so large files are never fully loaded
+        preview = "\n".join(txt for _, txt in itertools.islice(rows(), PREVIEW_ROWS))
+        if preview.strip():
+            st.caption(f"Preview of the first {PREVIEW_ROWS} rows")
+            html(preview.replace("\n","<br/>"), height=200, scrolling=True)
         else:
             st.warning("Invalid text file")
             st.stop()
 
-        evaluate(text_content, "bulk")
+        evaluate(rows, "bulk", preview, uploaded_file.name)
 
 with text_eval_tab:
     st.subheader("Assess an individual text message")
     text_input = st.text_input("Enter a message and click on anywhere else on the screen")
     if text_input:
-        evaluate(text_input, "text")
-
-with sample_tab:
-    st.subheader("Sample policy evaluation report")
+        evaluate(lambda: enumerate(text_input.split('\n'), 1), "text", text_input)
 
-    if os.path.exists(SAMPLE_DATA_FOLDER):
-        option = st.selectbox("Select a sample report",
-            tuple(file for file in os.listdir(SAMPLE_DATA_FOLDER) if os.path.isfile(os.path.join(SAMPLE_DATA_FOLDER, file)))
-        )
+@st.fragment
+def sample_report_view():
+    reports = lib_ui.list_reports(SAMPLE_DATA_FOLDER)
+    if len(reports) > 0:
+        option = st.selectbox("Select a sample report", reports)
         if option and len(option) > 0:
             # Plot UI
             file_path = f"{SAMPLE_DATA_FOLDER}{option}"
+            if not os.path.exists(file_path):
+                lib_ui.list_reports.clear()
+                st.warning(f"Sample file not found: {option}")
+                return
+
+            data = lib_ui.load_report(file_path)
+
+            st.text("Raw content:")
+            html((data.raw_content or "").replace("\n","<br/>"), height=200, scrolling=True)
+
+            lib_ui.plot_text_eval_report(data)
+
+            # Export HTML report
+            if st.button("Export report in HTML"):
+                report_html = lib_ui.generate_text_eval_html(data, option)
+
+                if report_html:
+                    # Create a BytesIO buffer
+                    buffer = BytesIO()
+                    # Write the content to the buffer
+                    buffer.write(report_html.encode())
+                    # Set the cursor to the beginning of the buffer
+                    buffer.seek(0)
+                    # Create a link to download the file
+                    st.download_button(label="Download File", data=buffer, file_name=f'{option}.html', key="download_button")
+
+            # Delete sample file
+            if st.button("Delete sample file"):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    lib_ui.list_reports.clear()
+                    st.text(f"Sample file deleted: {option}")
 
-            data = None
-            # Open and read the JSON file
-            with open(file_path, "r") as json_file:
-                data = json.load(json_file)
-
-                st.text("Raw content:")
-                html(data["raw_content"].replace("\n","<br/>"), height=200, scrolling=True)
-
-                lib_ui.plot_text_eval_report(data)
-
-                # Export HTML report
-                if st.button("Export report in HTML"):
-                    html = lib_ui.generate_text_eval_html(data, option)
-
-                    if html:
-                        # Create a BytesIO buffer
-                        buffer = BytesIO()
-                        # Write the content to the buffer
-                        buffer.write(html.encode())
-                        # Set the cursor to the beginning of the buffer
-                        buffer.seek(0)
-                        # Create a link to download the file
-                        st.download_button(label="Download File", data=buffer, file_name=f'{option}.html', key="download_button")
-                
-                # Delete sample file
-                if st.button("Delete sample file"):
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        st.text(f"Sample file deleted: {option}")
-
+with sample_tab:
+    st.subheader("Sample policy evaluation report")
+    sample_report_view()
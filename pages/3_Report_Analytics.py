@@ -0,0 +1,88 @@
+import streamlit as st
+import os
+import time
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from helper import store_lib
+from helper import ui_lib as lib_ui
+
+pool_id = os.environ.get("COGNITIO_POOL_ID")
+app_client_id = os.environ.get("COGNITIO_APP_CLIENT_ID")
+enable_cognito = pool_id is not None and app_client_id is not None and len(pool_id) > 0 and len(app_client_id) > 0
+if enable_cognito and ('is_logged_in' not in st.session_state or not st.session_state['is_logged_in']):
+        st.text("Please login using the Home page.")
+        st.stop()
+
+st.set_page_config(page_title="Report Analytics", layout="wide")
+st.title("Report Analytics")
+st.caption(f"Aggregates over all evaluation results stored in the columnar result store ({store_lib.STORE_FOLDER}).")
+
+col1, col2, col3 = st.columns(3)
+source = col1.selectbox("Source", ("all", "audio", "text"))
+days = col2.number_input("Reports from the last N days (0 for all)", min_value=0, value=7, step=1)
+threshold = col3.slider("Toxicity threshold", min_value=0.0, max_value=1.0, value=lib_ui.COMPREHEND_TOXICITY_THRESHOLD, step=0.05)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_segments(source, days):
+    return store_lib.load_segments(
+        source=None if source == "all" else source,
+        since=time.time() - days * 86400 if days > 0 else None
+    )
+
+start = time.time()
+segments = load_segments(source, days)
+load_time = time.time() - start
+
+total = len(segments["verdict"])
+if total == 0:
+    st.warning("No stored evaluation results. Run an audio or text policy evaluation first.")
+    st.stop()
+
+start = time.time()
+verdict = segments["verdict"]
+evaluated = int(np.count_nonzero(verdict != store_lib.VERDICT_NOT_EVALUATED))
+violations = int(np.count_nonzero(verdict == store_lib.VERDICT_CODES["Y"]))
+category_summary = store_lib.summarize_categories(segments, threshold)
+language_summary = store_lib.violation_rate_by(segments, "language")
+report_summary = store_lib.violation_rate_by(segments, "report")
+compute_time = time.time() - start
+
+m1, m2, m3, m4 = st.columns(4)
+m1.metric("Segments", total)
+m2.metric("Reports", len(report_summary["report"]))
+m3.metric("LLM evaluated", evaluated)
+m4.metric("Violations", violations)
+st.caption(f"Loaded in {load_time * 1000:.1f} ms, aggregated in {compute_time * 1000:.1f} ms")
+
+st.subheader("Toxicity score by category")
+st.dataframe(category_summary, use_container_width=True)
+
+category = st.selectbox("Score distribution", category_summary["category"])
+scores = segments[category].astype(np.float32)
+counts, edges = np.histogram(scores[~np.isnan(scores)], bins=20, range=(0.0, 1.0))
+st.bar_chart({"segments": counts}, x_label=f"{category} score (bins of {edges[1] - edges[0]:.2f})")
+
+st.subheader("Violation rate by language")
+st.dataframe(language_summary, use_container_width=True)
+
+st.subheader("Violation rate by report")
+st.dataframe(report_summary, use_container_width=True)
+
+st.subheader("Most toxic segments")
+top_n = min(20, total)
+toxicity = np.nan_to_num(segments["toxicity"].astype(np.float32), nan=-1.0)
+top = np.argpartition(-toxicity, top_n - 1)[0:top_n]
+top = top[np.argsort(-toxicity[top])]
+st.dataframe(
+    {
+        "report": segments["report"][top],
+        "segment": segments["segment"][top],
+        "text": segments["text"][top],
+        "toxicity": segments["toxicity"][top],
+        "verdict": verdict[top],
+    },
+    use_container_width=True
+)
@@ -0,0 +1,85 @@
+import streamlit as st
+import csv
+import io
+import os
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from helper import store_lib
+from helper import tuning_lib
+from helper import ui_lib as lib_ui
+
+pool_id = os.environ.get("COGNITIO_POOL_ID")
+app_client_id = os.environ.get("COGNITIO_APP_CLIENT_ID")
+enable_cognito = pool_id is not None and app_client_id is not None and len(pool_id) > 0 and len(app_client_id) > 0
+if enable_cognito and ('is_logged_in' not in st.session_state or not st.session_state['is_logged_in']):
+        st.text("Please login using the Home page.")
+        st.stop()
+
+st.set_page_config(page_title="Threshold Tuning", layout="wide")
+st.title("Toxicity Threshold Tuning")
+st.caption("What-if analysis of the toxicity thresholds that gate LLMs policy evaluation, computed offline from stored reports. No AWS services are called.")
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_segments(source):
+    return store_lib.load_segments(source=source)
+
+source = st.selectbox("Source", ("text", "audio"))
+segments = load_segments(source)
+total = len(segments["verdict"])
+if total == 0:
+    st.warning("No stored evaluation results. Run a policy evaluation first.")
+    st.stop()
+
+truth_source = st.radio("Ground truth", ("LLM verdicts", "Labeled set"), horizontal=True)
+if truth_source == "LLM verdicts":
+    truth = segments["verdict"]
+    st.caption("Only segments evaluated by the LLMs in the original run have a verdict. Segments skipped by the original threshold are excluded from precision and recall.")
+else:
+    labeled_file = st.file_uploader(key="labeled_file", label="Upload a CSV file with a header row and 'text' and 'label' columns (label: Y/N or 1/0)", type=['csv'])
+    if labeled_file is None:
+        st.stop()
+    reader = csv.DictReader(io.TextIOWrapper(labeled_file, encoding="utf-8"))
+    labels = {row["text"].strip(): row["label"] for row in reader if row.get("text")}
+    texts = segments["text"]
+    truth = tuning_lib.to_truth([labels.get(t.strip() if t else None, "") for t in texts])
+    st.caption(f"Matched {int(np.count_nonzero(truth >= 0))} of {total} stored segments to labels.")
+
+st.metric("Segments with ground truth", int(np.count_nonzero(truth >= 0)))
+
+st.subheader("Global threshold")
+current = lib_ui.TRANSCRIBE_TOXICITY_THRESHOLD if source == "audio" else lib_ui.COMPREHEND_TOXICITY_THRESHOLD
+thresholds = np.round(np.arange(0.0, 1.0001, 0.05), 2)
+sweep = tuning_lib.sweep_thresholds(segments["toxicity"], truth, thresholds)
+st.caption(f"Current threshold: {current}. LLM calls assume the toxicity dependency is enabled out of {total} segments.")
+st.line_chart({"precision": sweep["precision"], "recall": sweep["recall"], "f1": sweep["f1"]}, x_label="threshold index (0.05 steps)")
+st.dataframe(sweep, use_container_width=True)
+
+st.subheader("Per-category thresholds")
+category_scores = np.stack([segments[c].astype(np.float32) for c in store_lib.TOXICITY_CATEGORIES])
+category_sweep = tuning_lib.sweep_category_thresholds(category_scores, truth, thresholds)
+best = np.argmax(category_sweep["f1"], axis=1)
+st.dataframe(
+    {
+        "category": store_lib.TOXICITY_CATEGORIES,
+        "best threshold": thresholds[best],
+        "precision": category_sweep["precision"][np.arange(len(best)), best],
+        "recall": category_sweep["recall"][np.arange(len(best)), best],
+        "f1": category_sweep["f1"][np.arange(len(best)), best],
+    },
+    use_container_width=True
+)
+
+cols = st.columns(4)
+category_thresholds = [
+    cols[idx % 4].slider(c, min_value=0.0, max_value=1.0, value=float(thresholds[best[idx]]), step=0.05)
+    for idx, c in enumerate(store_lib.TOXICITY_CATEGORIES)
+]
+combined = tuning_lib.evaluate_category_thresholds(category_scores, truth, category_thresholds)
+m1, m2, m3, m4 = st.columns(4)
+m1.metric("Precision", f'{combined["precision"]:.3f}')
+m2.metric("Recall", f'{combined["recall"]:.3f}')
+m3.metric("LLM calls", combined["llm_calls"])
+m4.metric("LLM calls saved", combined["llm_calls_saved"])
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import contextlib
+import os
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from helper import lib
+from helper import batch_lib
+from helper import profile_lib
+
+CHAT_BATCH_MAX_SIZE = int(os.environ.get('CHAT_BATCH_MAX_SIZE', 10))
+CHAT_BATCH_MAX_WAIT_MS = int(os.environ.get('CHAT_BATCH_MAX_WAIT_MS', 50))
+CHAT_MAX_PENDING = int(os.environ.get('CHAT_MAX_PENDING', 1000))
+CHAT_MAX_CONCURRENT_BATCHES = int(os.environ.get('CHAT_MAX_CONCURRENT_BATCHES', 8))
+CHAT_REQUEST_TIMEOUT_SECONDS = float(os.environ.get('CHAT_REQUEST_TIMEOUT_SECONDS', 30))
+# Longer messages are rejected before batching instead of being cut down and evaluated in part
+CHAT_MAX_MESSAGE_BYTES = int(os.environ.get('CHAT_MAX_MESSAGE_BYTES', 5000))
+CHAT_TOXICITY_THRESHOLD = float(os.environ.get('COMPREHEND_TOXICITY_THRESHOLD', 0.6))
+CHAT_ENABLE_TOXICITY_DEPENDENCY = os.environ.get('CHAT_ENABLE_TOXICITY_DEPENDENCY', 'true').lower() == 'true'
+
+def moderate_batch(messages):
+    return lib.evaluate_text_batch(messages, CHAT_TOXICITY_THRESHOLD, CHAT_ENABLE_TOXICITY_DEPENDENCY)
+
+def verdict(item):
+    llm, toxicity = item.llm, item.toxicity
+    return {
+        "message": item.raw_text,
+        "language": item.raw_language_code,
+        "translated_text": item.translated_text,
+        "toxicity": None if toxicity is None else toxicity.toxicity,
+        "categories": {} if toxicity is None else toxicity.category_scores(),
+        "violation": None if llm is None else llm.answer == "Y",
+        "analysis": None if llm is None else llm.analysis,
+        "error": item.error,
+    }
+
+def too_long(message):
+    return len(message.encode("utf-8")) > CHAT_MAX_MESSAGE_BYTES
+
+async def moderate(message):
+    item = await asyncio.wait_for(batcher.submit(message), CHAT_REQUEST_TIMEOUT_SECONDS)
+    return verdict(item)
+
+async def moderate_endpoint(request):
+    body = await request.json()
+    message = (body.get("message") or "").strip()
+    if len(message) == 0:
+        return JSONResponse({"error": "message is required"}, status_code=400)
+    if too_long(message):
+        return JSONResponse({"error": f"message is longer than {CHAT_MAX_MESSAGE_BYTES} bytes"}, status_code=413)
+    try:
+        return JSONResponse(await moderate(message))
+    except batch_lib.Overloaded as e:
+        return JSONResponse({"error": f"overloaded: {e}"}, status_code=429, headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        return JSONResponse({"error": "timed out"}, status_code=504)
+    except Exception as e:
+        return JSONResponse({"error": type(e).__name__}, status_code=500)
+
+async def moderate_websocket(websocket):
+    # Each frame is {"id": ..., "message": ...}; verdicts are sent back as they complete, tagged with the id
+    await websocket.accept()
+    tasks = set()
+
+    async def reply(message_id, message):
+        if too_long(message):
+            await websocket.send_json({"error": f"message is longer than {CHAT_MAX_MESSAGE_BYTES} bytes", "id": message_id})
+            return
+        try:
+            response = await moderate(message)
+        except batch_lib.Overloaded as e:
+            response = {"error": f"overloaded: {e}", "retry_after": 1}
+        except asyncio.TimeoutError:
+            response = {"error": "timed out"}
+        except Exception as e:
+            response = {"error": type(e).__name__}
+        response["id"] = message_id
+        await websocket.send_json(response)
+
+    try:
+        while True:
+            frame = await websocket.receive_json()
+            task = asyncio.create_task(reply(frame.get("id"), (frame.get("message") or "").strip()))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        for task in tasks:
+            task.cancel()
+
+async def health_endpoint(request):
+    return JSONResponse(dict(batcher.status(), llm=lib.get_llm_stats(), regions=lib.get_region_stats()))
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await batcher.start()
+    yield
+    await batcher.stop()
+
+batcher = batch_lib.MicroBatcher(moderate_batch, CHAT_BATCH_MAX_SIZE, CHAT_BATCH_MAX_WAIT_MS, CHAT_MAX_PENDING, CHAT_MAX_CONCURRENT_BATCHES)
+
+app = Starlette(
+    routes=[
+        Route("/moderate", moderate_endpoint, methods=["POST"]),
+        Route("/health", health_endpoint),
+        WebSocketRoute("/ws", moderate_websocket),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    # Example: python services/chat_service.py --port 8080 --batch-size 10 --wait-ms 50
+    parser = argparse.ArgumentParser(description="Real-time chat moderation service with micro-batching.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--batch-size", type=int, default=CHAT_BATCH_MAX_SIZE, help="Maximum messages per batch")
+    parser.add_argument("--wait-ms", type=int, default=CHAT_BATCH_MAX_WAIT_MS, help="Maximum time to wait for a batch to fill")
+    parser.add_argument("--fake-aws", action="store_true", help="Use the local fake AWS services from helper/fake_aws.py")
+    parser.add_argument("--profile", action="store_true", default=profile_lib.PROFILE_EVALUATION,
+                        help="Profile the service until it stops and save .prof and .collapsed files under PROFILE_FOLDER (default: PROFILE_EVALUATION)")
+    args = parser.parse_args()
+
+    batcher.max_batch_size = args.batch_size
+    batcher.max_wait = args.wait_ms / 1000
+    if args.fake_aws:
+        from helper import fake_aws
+        fake_aws.install(lib)
+    with profile_lib.profile_run(f"{profile_lib.PROFILE_FOLDER}chat_service", args.profile, all_threads=True):
+        uvicorn.run(app, host=args.host, port=args.port)
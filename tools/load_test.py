@@ -0,0 +1,58 @@
+import argparse
+import json
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from helper import lib
+from helper import fake_aws
+from helper import loadtest_lib
+from helper import profile_lib
+from helper import ui_lib as lib_ui
+
+# Example:
+#   python tools/load_test.py --kind text --workload chats.txt --rate 20 --duration 60 --config latency.json
+parser = argparse.ArgumentParser(description="Replay a chat or audio workload against fake AWS services at an open-loop request rate.")
+parser.add_argument("--kind", choices=["text", "audio"], default="text")
+parser.add_argument("--workload", required=True, help="TXT/CSV file of chat messages, or a folder of audio files and/or stored audio reports")
+parser.add_argument("--rate", type=float, default=10.0, help="Target arrival rate in requests per second")
+parser.add_argument("--duration", type=float, default=None, help="Seconds to generate arrivals for")
+parser.add_argument("--requests", type=int, default=None, help="Number of requests to issue")
+parser.add_argument("--workers", type=int, default=64, help="Concurrent pipeline workers")
+parser.add_argument("--config", default=None, help="JSON file with per-service latency_ms, throttle_rate, failure_rate and max_attempts")
+parser.add_argument("--regions", default=None, help="Comma-separated regions to spread Comprehend, Translate and Bedrock calls across, one fake per region")
+parser.add_argument("--all-llm", action="store_true", help="Call the LLM on every message regardless of toxicity")
+parser.add_argument("--seed", type=int, default=None)
+parser.add_argument("--output", default=None, help="Write the summary as JSON to this file")
+parser.add_argument("--profile", action="store_true", default=profile_lib.PROFILE_EVALUATION,
+                    help="Profile the run and save .prof and .collapsed files under PROFILE_FOLDER (default: PROFILE_EVALUATION)")
+args = parser.parse_args()
+
+if args.duration is None and args.requests is None:
+    parser.error("one of --duration or --requests is required")
+
+config = None
+if args.config:
+    with open(args.config, "r") as f:
+        config = json.load(f)
+fakes = fake_aws.install(lib, config, args.seed, args.regions.split(",") if args.regions else None)
+
+if args.kind == "text":
+    workload = loadtest_lib.text_workload(args.workload)
+    handler = loadtest_lib.text_handler(lib_ui.COMPREHEND_TOXICITY_THRESHOLD, not args.all_llm)
+else:
+    workload = loadtest_lib.audio_workload(args.workload)
+    handler = loadtest_lib.audio_handler(lib_ui.TRANSCRIBE_TOXICITY_THRESHOLD, not args.all_llm)
+
+profile_prefix = f"{profile_lib.PROFILE_FOLDER}load_test_{args.kind}"
+with profile_lib.profile_run(profile_prefix, args.profile, all_threads=True) as profile:
+    summary = loadtest_lib.run_open_loop(workload, handler, args.rate, args.requests, args.duration, args.workers, args.seed)
+summary["clients"] = loadtest_lib.client_stats(fakes)
+summary["llm"] = lib.get_llm_stats()
+if profile is not None:
+    summary["profile"] = {"profile": profile.profile_path, "collapsed": profile.collapsed_path, "hotspots": profile.hotspots[0:10]}
+summary["regions"] = lib.get_region_stats()
+print(json.dumps(summary, indent=2))
+if args.output:
+    with open(args.output, "w") as f:
+        f.write(json.dumps(summary, indent=2))